@@ -2,7 +2,8 @@ import runpy
 import subprocess
 import sys
 
-if sys.prefix == sys.base_prefix:
-    sys.exit(subprocess.call(["uv", "run", __file__, *sys.argv[1:]]))
+if __name__ == "__main__":  # not when imported by spawned worker processes
+    if sys.prefix == sys.base_prefix:
+        sys.exit(subprocess.call(["uv", "run", __file__, *sys.argv[1:]]))
 
-runpy.run_module("hdx.scraper.buildings", run_name="__main__")
+    runpy.run_module("hdx.scraper.buildings", run_name="__main__")
@@ -1,28 +1,52 @@
 import logging
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
 from pathlib import Path
+from queue import Queue
 from shutil import rmtree
+from threading import Thread
 
 from dotenv import load_dotenv
 from hdx.api.configuration import Configuration
+from hdx.data.dataset import Dataset
 from hdx.facades.infer_arguments import facade
 from hdx.utilities.path import script_dir_plus_file, wheretostart_tempdir_batch
 from pandas import read_csv
+from tenacity import retry, stop_after_attempt, wait_fixed
 from tqdm import tqdm
 
 from ._version import __version__
-from .common.admin0 import download_admin0
+from .common.admin0 import cache_admin0, download_admin0
+from .common.budget import DiskBudget, country_source_bytes
+from .common.changes import changed_countries, input_fingerprints, record_country
 from .common.config import (
+    ATTEMPT,
+    BUDGET_POLL,
+    COUNTRY_SCRATCH_RATIO,
+    DUCKDB_TEMP,
+    GROUPING_WORKERS,
     PROVIDER_GOOGLE,
     PROVIDER_MICROSOFT,
+    PUBLISH_QUEUE_SIZE,
+    PUBLISH_WORKERS,
     RUN_DOWNLOAD,
     RUN_GOOGLE,
     RUN_GROUPING,
     RUN_MICROSOFT,
+    RUN_PARTITION,
+    SOURCE_PARQUET,
+    WAIT,
     data_dir,
     iso3_exclude,
     iso3_include,
 )
-from .common.group import group
+from .common.group import group_country, init_worker, resume_stage
+from .common.journal import PUBLISHED, record_stage
+from .common.manifest import manifest_path
+from .common.partition import partition_buildings
 from .dataset import generate_datasets
 from .google import __main__ as google
 from .microsoft import __main__ as microsoft
@@ -35,54 +59,251 @@ _LOOKUP = "hdx-scraper-buildings"
 _UPDATED_BY_SCRIPT = "HDX Scraper: Buildings"
 
 
+@retry(stop=stop_after_attempt(ATTEMPT), wait=wait_fixed(WAIT))
+def _create_dataset(dataset: Dataset, batch: str) -> None:
+    """Create or update a dataset in HDX."""
+    dataset.create_in_hdx(
+        remove_additional_resources=False,
+        match_resource_order=False,
+        updated_by_script=_UPDATED_BY_SCRIPT,
+        batch=batch,
+    )
+
+
 def _package(
-    provider: str, iso3: str, output_dir: Path, *, metadata_only: bool = False
-) -> None:
-    """Make a dataset."""
-    with wheretostart_tempdir_batch(folder=_LOOKUP) as info:
-        for dataset in generate_datasets(
-            provider, iso3, output_dir, metadata_only=metadata_only
-        ):
-            dataset.update_from_yaml(
-                script_dir_plus_file(
-                    str(cwd / f"config/hdx_dataset_{provider}.yaml"),
-                    main,
-                ),
-            )
-            dataset.create_in_hdx(
-                remove_additional_resources=False,
-                match_resource_order=False,
-                updated_by_script=_UPDATED_BY_SCRIPT,
-                batch=info["batch"],
-            )
+    provider: str,
+    iso3: str,
+    output_dir: Path,
+    batch: str,
+    *,
+    metadata_only: bool = False,
+) -> bool:
+    """Make a dataset in a batch, returning False if there was none to make."""
+    created = False
+    for dataset in generate_datasets(
+        provider, iso3, output_dir, metadata_only=metadata_only
+    ):
+        dataset.update_from_yaml(
+            script_dir_plus_file(
+                str(cwd / f"config/hdx_dataset_{provider}.yaml"),
+                main,
+            ),
+        )
+        _create_dataset(dataset, batch)
+        created = True
+    return created
 
 
-def _group_and_package(provider: str, *, metadata_only: bool = False) -> None:
-    """Create resources for each country and then create a HDX dataset."""
+def _country_codes(provider: str) -> list[str]:
+    """Return the countries to process for a provider, after include/exclude."""
     country_list = cwd / provider / "countries.csv"
     country_lookup = read_csv(country_list, usecols=["iso_3"]).drop_duplicates()
-    country_codes = country_lookup["iso_3"].to_list()
-    pbar = tqdm(country_codes)
-    for iso3 in pbar:
+    return [
+        iso3
+        for iso3 in country_lookup["iso_3"].to_list()
+        if not (len(iso3_include) and iso3 not in iso3_include)
+        and not (len(iso3_exclude) and iso3 in iso3_exclude)
+    ]
+
+
+def _output_dir(provider: str, iso3: str) -> Path:
+    """Return the working directory for a country's resources."""
+    return data_dir / provider / "outputs" / iso3.lower()
+
+
+def _group_in_sequence(
+    provider: str,
+    fingerprints: dict[str, str],
+    partition_dir: Path | None,
+    budget: DiskBudget,
+    scratch: dict[str, int],
+) -> Iterator[str]:
+    """Group countries one after another, yielding each when done.
+
+    Each waits until its projected scratch space fits the disk budget.
+    """
+    pbar = tqdm(fingerprints.items())
+    for iso3, fingerprint in pbar:
         pbar.set_description(iso3)
-        if len(iso3_include) and iso3 not in iso3_include:
-            continue
-        if len(iso3_exclude) and iso3 in iso3_exclude:
-            continue
-        output_dir = data_dir / provider / "outputs" / iso3.lower()
-        if not metadata_only:
-            group(provider, iso3, output_dir)
-        _package(provider, iso3, output_dir, metadata_only=metadata_only)
-        if output_dir.exists():
-            rmtree(output_dir)
+        budget.reserve(iso3, scratch.get(iso3, 0))
+        output_dir = _output_dir(provider, iso3)
+        group_country(provider, iso3, output_dir, partition_dir, fingerprint)
+        yield iso3
+
+
+def _group_in_parallel(
+    provider: str,
+    fingerprints: dict[str, str],
+    partition_dir: Path | None,
+    budget: DiskBudget,
+    scratch: dict[str, int],
+) -> Iterator[str]:
+    """Group countries in GROUPING_WORKERS processes while they fit the budget."""
+    pending = deque(fingerprints.items())
+    pbar = tqdm(total=len(fingerprints))
+    futures = {}
+    pool = _grouping_pool()
+    try:
+        while pending or futures:
+            while pending and len(futures) < GROUPING_WORKERS:
+                iso3, fp = pending[0]
+                if not budget.try_reserve(iso3, scratch.get(iso3, 0)):
+                    break
+                output_dir = _output_dir(provider, iso3)
+                try:
+                    future = pool.submit(
+                        group_country, provider, iso3, output_dir, partition_dir, fp
+                    )
+                except BrokenProcessPool:
+                    logger.warning("A grouping worker died, restarting the workers")
+                    budget.release(iso3)
+                    pool.shutdown(cancel_futures=True)
+                    pool = _grouping_pool()
+                    continue
+                pending.popleft()
+                futures[future] = iso3
+            if not futures:
+                budget.wait()
+                continue
+            done, _ = wait(futures, timeout=BUDGET_POLL, return_when=FIRST_COMPLETED)
+            for future in done:
+                iso3 = futures.pop(future)
+                pbar.set_description(iso3)
+                pbar.update()
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception("Grouping failed for %s", iso3)
+                    budget.release(iso3)
+                    continue
+                yield iso3
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def _grouping_pool() -> ProcessPoolExecutor:
+    """Start GROUPING_WORKERS processes from a fork server."""
+    return ProcessPoolExecutor(
+        GROUPING_WORKERS,
+        mp_context=get_context("forkserver"),
+        initializer=init_worker,
+    )
+
+
+def _publish(
+    provider: str,
+    publish_queue: Queue,
+    fingerprints: dict[str, str],
+    budget: DiskBudget,
+    batch: str,
+) -> None:
+    """Publish grouped countries from the queue until a None arrives."""
+    while (iso3 := publish_queue.get()) is not None:
+        output_dir = _output_dir(provider, iso3)
+        try:
+            if _package(provider, iso3, output_dir, batch):
+                record_country(provider, iso3, fingerprints[iso3])
+                record_stage(provider, iso3, fingerprints[iso3], PUBLISHED)
+            else:
+                logger.warning("No resources for %s, not recorded", iso3)
+        except Exception:
+            logger.exception("Publishing failed for %s", iso3)
+        else:
+            rmtree(output_dir, ignore_errors=True)
+        finally:
+            budget.release(iso3)
+
+
+def _partition(
+    provider: str,
+    to_partition: list[str],
+    budget: DiskBudget,
+    source_bytes: dict[str, int],
+) -> Path | None:
+    """Partition the countries, holding their source bytes in the budget.
+
+    Returns None when the partitions would not fit in the disk budget.
+    """
+    partition_bytes = sum(source_bytes.get(iso3, 0) for iso3 in to_partition)
+    if partition_bytes > budget.capacity:
+        logger.warning(
+            "Skipping partition of %d bytes, over the disk budget", partition_bytes
+        )
+        return None
+    for iso3 in to_partition:
+        budget.hold(iso3, source_bytes.get(iso3, 0))
+    partition_dir = data_dir / provider / "partitions"
+    partition_buildings(
+        SOURCE_PARQUET.format(provider=provider),
+        partition_dir,
+        to_partition,
+        manifest_path(provider),
+    )
+    return partition_dir
+
+
+def _group_and_package(provider: str, *, metadata_only: bool = False) -> None:
+    """Group the countries whose inputs changed and publish their datasets."""
+    country_codes = _country_codes(provider)
+    if metadata_only:
+        with wheretostart_tempdir_batch(folder=_LOOKUP) as info:
+            for iso3 in tqdm(country_codes):
+                output_dir = _output_dir(provider, iso3)
+                _package(provider, iso3, output_dir, info["batch"], metadata_only=True)
+        return
+    country_codes = changed_countries(provider, country_codes)
+    fingerprints = input_fingerprints(provider, country_codes)
+    stages = {
+        iso3: resume_stage(
+            provider,
+            iso3,
+            _output_dir(provider, iso3),
+            fingerprints.setdefault(iso3, ""),
+        )
+        for iso3 in country_codes
+    }
+    fingerprints = {
+        iso3: fingerprints[iso3] for iso3 in country_codes if stages[iso3] != PUBLISHED
+    }
+    if not fingerprints:
+        return
+    budget = DiskBudget(f"Grouping {provider}")
+    source_bytes = country_source_bytes(provider, list(fingerprints))
+    scratch = {x: COUNTRY_SCRATCH_RATIO * size for x, size in source_bytes.items()}
+    partition_dir = None
+    to_partition = [iso3 for iso3 in fingerprints if stages[iso3] is None]
+    if RUN_PARTITION and to_partition:
+        partition_dir = _partition(provider, to_partition, budget, source_bytes)
+    grouper = _group_in_parallel if GROUPING_WORKERS > 1 else _group_in_sequence
+    publish_queue = Queue(maxsize=PUBLISH_QUEUE_SIZE)
+    with wheretostart_tempdir_batch(folder=_LOOKUP) as info:
+        args = (provider, publish_queue, fingerprints, budget, info["batch"])
+        publishers = [
+            Thread(target=_publish, args=args) for _ in range(max(1, PUBLISH_WORKERS))
+        ]
+        for publisher in publishers:
+            publisher.start()
+        try:
+            for iso3 in grouper(provider, fingerprints, partition_dir, budget, scratch):
+                publish_queue.put(iso3)
+        finally:
+            for _ in publishers:
+                publish_queue.put(None)
+            for publisher in publishers:
+                publisher.join()
+    if partition_dir:
+        rmtree(partition_dir, ignore_errors=True)
+    budget.report()
 
 
 def main(metadata_only: bool = False) -> None:  # noqa: FBT001, FBT002
     """Generate datasets and create them in HDX."""
     logger.info("##### %s version %s ####", _LOOKUP, __version__)
     Configuration.read()
+    rmtree(DUCKDB_TEMP, ignore_errors=True)  # spill left by a crashed run
     if RUN_GROUPING and not metadata_only:
         download_admin0(data_dir)
+        cache_admin0()
     if RUN_GOOGLE:
         if RUN_DOWNLOAD:
             google.main()
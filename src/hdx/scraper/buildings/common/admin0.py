@@ -1,54 +1,63 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashlib import file_digest
+from itertools import batched
 from pathlib import Path
+from shutil import rmtree
 from subprocess import run
-from urllib.parse import urlencode
 
-from httpx import Client
+from duckdb import DuckDBPyConnection
+from httpx import Client, HTTPStatusError, Response, TransportError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_fixed
 
 from .config import (
+    ADM0_CACHE,
+    ADM0_CELL_SIZE,
+    ADM0_MAX_DEPTH,
+    ADM0_PAGE_SIZE,
+    ADM0_PIECE_VERTICES,
+    ADM0_WORKERS,
     ARCGIS_ADM0_URL,
     ARCGIS_PASSWORD,
     ARCGIS_SERVER,
     ARCGIS_USERNAME,
+    ATTEMPT,
+    GLOBAL_ADM0,
     TIMEOUT,
+    WAIT,
 )
+from .engine import engine
+
+logger = logging.getLogger(__name__)
 
 _ARCGIS_OBJECTID = "esriFieldTypeOID"
 
 
 def download_admin0(data_dir: Path) -> None:
-    """Download Admin 0 from ArcGIS Feature Services."""
-    token_url = f"{ARCGIS_SERVER}/portal/sharing/rest/generateToken"
-    with Client(http2=True, timeout=TIMEOUT) as client:
-        token = client.post(
-            token_url,
-            data={
-                "username": ARCGIS_USERNAME,
-                "password": ARCGIS_PASSWORD,
-                "referer": f"{ARCGIS_SERVER}/portal",
-                "expiration": 1440,
-                "f": "json",
-            },
-        ).json()["token"]
-        params = {"f": "json", "token": token}
-        fields = client.get(ARCGIS_ADM0_URL, params=params).json()["fields"]
-    objectid = next(x["name"] for x in fields if x["type"] == _ARCGIS_OBJECTID)
-    field_names = ",".join(
-        x["name"]
-        for x in fields
-        if x["type"] != _ARCGIS_OBJECTID
-        and not x.get("virtual")
-        and not x["name"].lower().startswith("objectid")
-    )
-    query_params = urlencode(
-        {**params, "orderByFields": objectid, "outFields": field_names, "where": "1=1"},
-    )
-    query_url = f"{ARCGIS_ADM0_URL}/query?{query_params}"
+    """Download Admin 0 from ArcGIS Feature Services.
+
+    Features are fetched as pages of ADM0_PAGE_SIZE object IDs, ADM0_WORKERS
+    at a time, then merged, reprojected and cleaned by GDAL. The layer's last
+    edit date, or its ETag, is kept next to the output, and the download is
+    skipped when it is unchanged.
+    """
     output_file = data_dir / "bnda_cty.parquet"
+    version_file = data_dir / "bnda_cty.version"
     output_file.parent.mkdir(parents=True, exist_ok=True)
+    with Client(http2=True, timeout=TIMEOUT) as client:
+        fetched = _fetch_if_changed(client, output_file, version_file)
+    if fetched is None:
+        return
+    pages, version = fetched
+    merged_file = data_dir / "bnda_cty.esrijson"
+    merged_file.write_text(json.dumps({**pages[0], "features": _features(pages)}))
+    version_file.unlink(missing_ok=True)
     run(
         [
             *["gdal", "vector", "pipeline", "!"],
-            *["read", "ESRIJSON:" + query_url, "!"],
+            *["read", "ESRIJSON:" + str(merged_file), "!"],
             *["reproject", "--dst-crs=EPSG:4326", "!"],
             *["clean-coverage", "!"],
             *["make-valid", "!"],
@@ -60,5 +69,268 @@ def download_admin0(data_dir: Path) -> None:
             "--lco=GEOMETRY_NAME=geometry",
             "--lco=USE_PARQUET_GEO_TYPES=YES",
         ],
-        check=False,
+        check=True,
     )
+    merged_file.unlink()
+    if version:
+        version_file.write_text(version)
+
+
+def _fetch_if_changed(
+    client: Client, output_file: Path, version_file: Path
+) -> tuple[list[dict], str | None] | None:
+    """Fetch the pages of the layer with its version, unless unchanged.
+
+    Returns None when the version matches the last download, or when the
+    layer is empty and a previous download is kept instead.
+    """
+    params = {"f": "json", "token": _token(client)}
+    r = client.get(ARCGIS_ADM0_URL, params=params)
+    r.raise_for_status()
+    layer = _arcgis_json(r)
+    version = layer.get("editingInfo", {}).get("lastEditDate")
+    version = str(version) if version else r.headers.get("ETag")
+    if (
+        version
+        and output_file.exists()
+        and version_file.exists()
+        and version_file.read_text() == version
+    ):
+        logger.info("Admin 0 unchanged since %s, skipping download", version)
+        return None
+    pages = _fetch_pages(client, layer, params)
+    if not pages:
+        if output_file.exists():
+            logger.error("Admin 0 layer is empty, keeping the last download")
+            return None
+        msg = "Admin 0 layer is empty"
+        raise ValueError(msg)
+    return pages, version
+
+
+def _token(client: Client) -> str:
+    """Generate an ArcGIS token for the configured user."""
+    r = client.post(
+        f"{ARCGIS_SERVER}/portal/sharing/rest/generateToken",
+        data={
+            "username": ARCGIS_USERNAME,
+            "password": ARCGIS_PASSWORD,
+            "referer": f"{ARCGIS_SERVER}/portal",
+            "expiration": 1440,
+            "f": "json",
+        },
+    )
+    r.raise_for_status()
+    return _arcgis_json(r)["token"]
+
+
+def _fetch_pages(client: Client, layer: dict, params: dict) -> list[dict]:
+    """Fetch every feature of the layer in pages of object IDs, in parallel.
+
+    Pages are cut from the sorted object IDs and queried as ID ranges, so
+    each holds at most ADM0_PAGE_SIZE features however sparse the IDs are.
+    A layer without features gives no pages.
+    """
+    fields = layer["fields"]
+    objectid = next(x["name"] for x in fields if x["type"] == _ARCGIS_OBJECTID)
+    field_names = ",".join(
+        x["name"]
+        for x in fields
+        if x["type"] != _ARCGIS_OBJECTID
+        and not x.get("virtual")
+        and not x["name"].lower().startswith("objectid")
+    )
+    r = client.get(
+        f"{ARCGIS_ADM0_URL}/query",
+        params={**params, "where": "1=1", "returnIdsOnly": "true"},
+    )
+    r.raise_for_status()
+    ids = sorted(_arcgis_json(r).get("objectIds") or [])  # null for no features
+    page_size = min(ADM0_PAGE_SIZE, layer.get("maxRecordCount") or ADM0_PAGE_SIZE)
+    wheres = [
+        f"{objectid} >= {page[0]} AND {objectid} <= {page[-1]}"
+        for page in batched(ids, page_size, strict=False)
+    ]
+    query = {**params, "orderByFields": objectid, "outFields": field_names}
+    fetch_page = partial(_fetch_page, client, query)
+    with ThreadPoolExecutor(ADM0_WORKERS) as pool:
+        pages = list(pool.map(fetch_page, wheres))
+    logger.info("Downloaded %d admin 0 features in %d pages", len(ids), len(pages))
+    return pages
+
+
+def _transient(exc: BaseException) -> bool:
+    """Tell whether a request failed on the network or the server side."""
+    if isinstance(exc, HTTPStatusError):
+        return exc.response.is_server_error
+    return isinstance(exc, TransportError)
+
+
+@retry(
+    retry=retry_if_exception(_transient),
+    stop=stop_after_attempt(ATTEMPT),
+    wait=wait_fixed(WAIT),
+)
+def _fetch_page(client: Client, query: dict, where: str) -> dict:
+    """Query one page of features as ESRI JSON.
+
+    Only network and server errors are retried, as a page over the record
+    limit or without features would come back the same.
+    """
+    r = client.post(f"{ARCGIS_ADM0_URL}/query", data={**query, "where": where})
+    r.raise_for_status()
+    page = _arcgis_json(r)
+    if page.get("exceededTransferLimit"):
+        msg = f"Page over the server record limit: {where}"
+        raise ValueError(msg)
+    if "features" not in page:
+        msg = f"Page without features: {where}"
+        raise ValueError(msg)
+    return page
+
+
+def _arcgis_json(r: Response) -> dict:
+    """Return the body of an ArcGIS response, which reports errors in it."""
+    body = r.json()
+    if "error" in body:
+        msg = f"ArcGIS error from {r.url}: {body['error']}"
+        raise ValueError(msg)
+    return body
+
+
+def _features(pages: list[dict]) -> list[dict]:
+    """Concatenate the features of every page, in order."""
+    return [feature for page in pages for feature in page["features"]]
+
+
+def cache_admin0() -> None:
+    """Precompute unioned and subdivided country geometries from Admin 0.
+
+    Writes one unioned geometry with its bbox per country, and a quadtree of
+    small pieces per country, each clipped to its cell and classified as
+    inside, outside or on the boundary of the country. Skipped when
+    bnda_cty.parquet is unchanged since the cache was last built.
+    """
+    input_file = GLOBAL_ADM0
+    cache_dir = ADM0_CACHE
+    digest_file = cache_dir / "source.sha256"
+    with input_file.open("rb") as f:
+        digest = file_digest(f, "sha256").hexdigest()
+    if digest_file.exists() and digest_file.read_text() == digest:
+        return
+    rmtree(cache_dir, ignore_errors=True)
+    cache_dir.mkdir(parents=True)
+    with engine() as con:
+        con.sql(f"""
+            CREATE TEMP TABLE countries AS
+            SELECT iso3cd AS iso3, ST_MemUnion_Agg(geometry) AS geometry
+            FROM '{input_file}'
+            GROUP BY iso3cd;
+            CREATE TEMP TABLE pieces AS
+            SELECT *, {_CELL_STATUS} AS status
+            FROM (
+                SELECT
+                    iso3,
+                    geometry,
+                    ST_XMin(geometry) AS cx0,
+                    ST_YMin(geometry) AS cy0,
+                    ST_XMax(geometry) + 1e-6 AS cx1,
+                    ST_YMax(geometry) + 1e-6 AS cy1
+                FROM countries
+            );
+        """)
+        for _ in range(ADM0_MAX_DEPTH):
+            if not _split_pieces(con):
+                break
+        con.sql(f"""
+            COPY (
+                SELECT
+                    iso3,
+                    geometry,
+                    ST_XMin(geometry) AS xmin,
+                    ST_YMin(geometry) AS ymin,
+                    ST_XMax(geometry) AS xmax,
+                    ST_YMax(geometry) AS ymax
+                FROM countries
+            )
+            TO '{cache_dir / "countries.parquet"}'
+            WITH (COMPRESSION zstd);
+            COPY (
+                SELECT
+                    iso3,
+                    geometry,
+                    cx0,
+                    cy0,
+                    cx1,
+                    cy1,
+                    ST_MakeEnvelope(cx0, cy0, cx1, cy1) AS cell,
+                    status
+                FROM pieces
+            )
+            TO '{cache_dir / "pieces.parquet"}'
+            WITH (COMPRESSION zstd);
+        """)
+    digest_file.write_text(digest)
+
+
+_CELL_STATUS = f"""
+    CASE
+        WHEN ST_IsEmpty(geometry) THEN 'outside'
+        WHEN
+            ST_NPoints(geometry) <= {ADM0_PIECE_VERTICES} AND
+            ST_Covers(geometry, ST_MakeEnvelope(cx0, cy0, cx1, cy1))
+        THEN 'inside'
+        ELSE 'boundary'
+    END
+"""
+
+_NEEDS_SPLIT = f"""
+    status = 'boundary' AND (
+        ST_NPoints(geometry) > {ADM0_PIECE_VERTICES} OR
+        greatest(cx1 - cx0, cy1 - cy0) > {ADM0_CELL_SIZE}
+    )
+"""
+
+
+def _split_pieces(con: DuckDBPyConnection) -> bool:
+    """Split every boundary piece that is still too detailed or too large.
+
+    Pieces above ADM0_PIECE_VERTICES or with a cell wider than ADM0_CELL_SIZE
+    are cut into their four quadrants. Cells that end up outside the country
+    are kept as empty pieces so that the cells of a country always tile its
+    bbox. Returns False if no piece needed splitting.
+    """
+    count = con.sql(f"SELECT count(*) FROM pieces WHERE {_NEEDS_SPLIT}").fetchone()
+    if not count or not count[0]:
+        return False
+    con.sql(f"""
+        CREATE OR REPLACE TEMP TABLE pieces AS
+        SELECT * FROM pieces
+        WHERE NOT ({_NEEDS_SPLIT})
+        UNION ALL
+        SELECT *, {_CELL_STATUS} AS status
+        FROM (
+            SELECT
+                iso3,
+                ST_CollectionExtract(
+                    ST_Intersection(geometry, ST_MakeEnvelope(cx0, cy0, cx1, cy1)),
+                    3
+                ) AS geometry,
+                cx0,
+                cy0,
+                cx1,
+                cy1
+            FROM (
+                SELECT
+                    iso3,
+                    geometry,
+                    unnest([cx0, (cx0 + cx1) / 2, cx0, (cx0 + cx1) / 2]) AS cx0,
+                    unnest([cy0, cy0, (cy0 + cy1) / 2, (cy0 + cy1) / 2]) AS cy0,
+                    unnest([(cx0 + cx1) / 2, cx1, (cx0 + cx1) / 2, cx1]) AS cx1,
+                    unnest([(cy0 + cy1) / 2, (cy0 + cy1) / 2, cy1, cy1]) AS cy1
+                FROM pieces
+                WHERE {_NEEDS_SPLIT}
+            )
+        );
+    """)
+    return True
@@ -0,0 +1,291 @@
+import struct
+import zlib
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+from multiprocessing import cpu_count
+from pathlib import Path
+from time import localtime
+from typing import TYPE_CHECKING, BinaryIO
+
+from tqdm import tqdm
+
+if TYPE_CHECKING:
+    from hashlib import _Hash
+
+_CHUNK_SIZE = 1024 * 1024  # 1 MiB of input per deflate job
+_WINDOW_SIZE = 32 * 1024  # deflate history primed from the previous chunk
+_MAX_PENDING = 2 * cpu_count()  # chunks deflating ahead of the writer
+_ZIP64_LIMIT = (1 << 31) - 1
+_ZIP64_COUNT_LIMIT = 0xFFFF
+_ZIP64_VERSION = 45
+_DEFLATED = 8
+_STORED = 0
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_UNIX = 3
+
+
+def zip_directory(input_dir: Path, output_zip: Path) -> str:
+    """Zip the contents of a directory, deflating members in parallel.
+
+    Members are named relative to input_dir, as with shutil.make_archive.
+    Each file is cut into chunks that are deflated concurrently, each primed
+    with the tail of the previous chunk, and joined into one deflate stream.
+    The archive is written front to back, using data descriptors instead of
+    seeking back to patch headers, and the central directory goes last.
+
+    Returns a SHA-256 of the member names and contents, taken from the
+    chunks as they are read, so unlike a hash of the zip it does not depend
+    on modification times or compression.
+    """
+    paths = sorted(input_dir.rglob("*"))
+    total = sum(x.stat().st_size for x in paths if x.is_file())
+    entries = []
+    digest = sha256()
+    with (
+        output_zip.open("wb") as f,
+        ThreadPoolExecutor(cpu_count()) as pool,
+        tqdm(
+            total=total, unit="B", unit_scale=True, desc=output_zip.name, leave=False
+        ) as pbar,
+    ):
+        for path in paths:
+            name = path.relative_to(input_dir).as_posix()
+            if path.is_dir():
+                entries.append(_write_dir(f, path, name + "/"))
+                digest.update(f"{name}/\0".encode())
+            else:
+                entries.append(_write_file(f, pool, pbar, digest, path, name))
+        _write_central_directory(f, entries)
+    return digest.hexdigest()
+
+
+def _dos_time(path: Path) -> tuple[int, int]:
+    """Return the DOS date and time of a file's modification time."""
+    year, month, day, hour, minute, second = localtime(path.stat().st_mtime)[:6]
+    year = max(year, 1980)
+    return (
+        (year - 1980) << 9 | month << 5 | day,
+        hour << 11 | minute << 5 | second // 2,
+    )
+
+
+def _encode_name(name: str) -> tuple[bytes, int]:
+    """Encode a member name, flagging it as UTF-8 when it is not ASCII."""
+    try:
+        return name.encode("ascii"), 0
+    except UnicodeEncodeError:
+        return name.encode("utf-8"), _FLAG_UTF8
+
+
+def _chunks(path: Path) -> Iterator[tuple[bytes, bytes, bool]]:
+    """Yield each chunk of a file with the history before it and a last flag."""
+    with path.open("rb") as f:
+        history = b""
+        chunk = f.read(_CHUNK_SIZE)
+        while True:
+            following = f.read(_CHUNK_SIZE)
+            yield chunk, history, not following
+            if not following:
+                return
+            history = chunk[-_WINDOW_SIZE:]
+            chunk = following
+
+
+def _deflate(chunk: bytes, history: bytes, *, last: bool) -> bytes:
+    """Raw-deflate a chunk so it can be joined to the chunks around it.
+
+    Chunks before the last end on a sync flush, leaving the stream byte
+    aligned and unfinished, and only the last one sets the final block.
+    """
+    if history:
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=history
+        )
+    else:
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+    flush_mode = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(chunk) + compressor.flush(flush_mode)
+
+
+def _write_dir(f: BinaryIO, path: Path, name: str) -> dict:
+    """Write the local header of a directory entry."""
+    encoded, flags = _encode_name(name)
+    date, time = _dos_time(path)
+    offset = f.tell()
+    f.write(
+        struct.pack(
+            "<4s5H3L2H",
+            b"PK\x03\x04",
+            20,
+            flags,
+            _STORED,
+            time,
+            date,
+            0,
+            0,
+            0,
+            len(encoded),
+            0,
+        )
+    )
+    f.write(encoded)
+    return {
+        "name": encoded,
+        "flags": flags,
+        "method": _STORED,
+        "time": time,
+        "date": date,
+        "crc": 0,
+        "compress_size": 0,
+        "file_size": 0,
+        "offset": offset,
+        "attr": (path.stat().st_mode & 0xFFFF) << 16 | 0x10,
+    }
+
+
+def _write_file(  # noqa: PLR0913
+    f: BinaryIO,
+    pool: ThreadPoolExecutor,
+    pbar: tqdm,
+    digest: "_Hash",
+    path: Path,
+    name: str,
+) -> dict:
+    """Write a file entry, its deflated data and its data descriptor.
+
+    The name, size and contents of the file are added to digest.
+    """
+    encoded, flags = _encode_name(name)
+    flags |= _FLAG_DATA_DESCRIPTOR
+    date, time = _dos_time(path)
+    offset = f.tell()
+    extra = struct.pack("<2H2Q", 1, 16, 0, 0)
+    f.write(
+        struct.pack(
+            "<4s5H3L2H",
+            b"PK\x03\x04",
+            _ZIP64_VERSION,
+            flags,
+            _DEFLATED,
+            time,
+            date,
+            0,
+            0xFFFFFFFF,
+            0xFFFFFFFF,
+            len(encoded),
+            len(extra),
+        )
+    )
+    f.write(encoded)
+    f.write(extra)
+    crc = 0
+    file_size = 0
+    compress_size = 0
+    pending: deque[tuple[Future[bytes], int]] = deque()
+
+    def write_next() -> None:
+        nonlocal compress_size
+        future, size = pending.popleft()
+        data = future.result()
+        f.write(data)
+        compress_size += len(data)
+        pbar.update(size)
+
+    digest.update(f"{name}\0".encode() + struct.pack("<Q", path.stat().st_size))
+    for chunk, history, last in _chunks(path):
+        crc = zlib.crc32(chunk, crc)
+        digest.update(chunk)
+        file_size += len(chunk)
+        pending.append((pool.submit(_deflate, chunk, history, last=last), len(chunk)))
+        if len(pending) >= _MAX_PENDING:
+            write_next()
+    while pending:
+        write_next()
+    f.write(struct.pack("<4sL2Q", b"PK\x07\x08", crc, compress_size, file_size))
+    return {
+        "name": encoded,
+        "flags": flags,
+        "method": _DEFLATED,
+        "time": time,
+        "date": date,
+        "crc": crc,
+        "compress_size": compress_size,
+        "file_size": file_size,
+        "offset": offset,
+        "attr": (path.stat().st_mode & 0xFFFF) << 16,
+    }
+
+
+def _write_central_directory(f: BinaryIO, entries: list[dict]) -> None:
+    """Write the central directory and end records, using ZIP64 when needed."""
+    start = f.tell()
+    for entry in entries:
+        zip64 = []
+        file_size = entry["file_size"]
+        compress_size = entry["compress_size"]
+        offset = entry["offset"]
+        if file_size > _ZIP64_LIMIT or compress_size > _ZIP64_LIMIT:
+            zip64 += [file_size, compress_size]
+            file_size = compress_size = 0xFFFFFFFF
+        if offset > _ZIP64_LIMIT:
+            zip64.append(offset)
+            offset = 0xFFFFFFFF
+        extra = b""
+        if zip64:
+            extra = struct.pack(f"<2H{len(zip64)}Q", 1, 8 * len(zip64), *zip64)
+        version = _ZIP64_VERSION if entry["method"] == _DEFLATED else 20
+        f.write(
+            struct.pack(
+                "<4s4B4H3L5H2L",
+                b"PK\x01\x02",
+                version,
+                _UNIX,
+                version,
+                0,
+                entry["flags"],
+                entry["method"],
+                entry["time"],
+                entry["date"],
+                entry["crc"],
+                compress_size,
+                file_size,
+                len(entry["name"]),
+                len(extra),
+                0,
+                0,
+                0,
+                entry["attr"],
+                offset,
+            )
+        )
+        f.write(entry["name"])
+        f.write(extra)
+    end = f.tell()
+    count = len(entries)
+    size = end - start
+    if count >= _ZIP64_COUNT_LIMIT or size > _ZIP64_LIMIT or start > _ZIP64_LIMIT:
+        f.write(
+            struct.pack(
+                "<4sQ2H2L4Q",
+                b"PK\x06\x06",
+                44,
+                _ZIP64_VERSION,
+                _ZIP64_VERSION,
+                0,
+                0,
+                count,
+                count,
+                size,
+                start,
+            )
+        )
+        f.write(struct.pack("<4sLQL", b"PK\x06\x07", 0, end, 1))
+        count = min(count, _ZIP64_COUNT_LIMIT)
+        size = min(size, 0xFFFFFFFF)
+        start = min(start, 0xFFFFFFFF)
+    f.write(struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, count, count, size, start, 0))
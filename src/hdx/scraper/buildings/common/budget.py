@@ -0,0 +1,148 @@
+import logging
+from asyncio import to_thread
+from shutil import disk_usage
+from threading import Condition
+
+from .config import (
+    BUDGET_POLL,
+    DISK_BUDGET_GB,
+    GZ_EXPANSION,
+    TILE_SIZE_UNKNOWN,
+    data_dir,
+)
+from .engine import engine, load_adm0
+from .manifest import manifest_path
+
+logger = logging.getLogger(__name__)
+
+_GB = 1024 * 1024 * 1024
+
+
+class DiskBudget:
+    """Admit jobs while their projected scratch space fits a budget.
+
+    A job too big for the budget is admitted once no other started job holds
+    space.
+    """
+
+    def __init__(self, name: str) -> None:
+        """Size the budget from DISK_BUDGET_GB, or 90% of the space free now."""
+        usage = disk_usage(data_dir)
+        self.name = name
+        self.capacity = int(DISK_BUDGET_GB * _GB) or int(usage.free * 0.9)
+        self.reserved = 0
+        self.high_water = 0
+        self._baseline = usage.used
+        self._grown = 0
+        self._held: dict[str, int] = {}
+        self._not_started: set[str] = set()
+        self._changed = Condition()
+
+    def hold(self, key: str, nbytes: int) -> None:
+        """Hold nbytes for a job that has not started, whether or not it fits."""
+        with self._changed:
+            self._held[key] = self._held.get(key, 0) + nbytes
+            self._not_started.add(key)
+            self.reserved += nbytes
+            self.high_water = max(self.high_water, self.reserved)
+            self._measure()
+
+    def try_reserve(self, key: str, nbytes: int) -> bool:
+        """Raise the space held for key to nbytes if it fits, without waiting."""
+        with self._changed:
+            held = self._held.get(key, 0)
+            extra = max(0, nbytes - held)
+            started = sum(
+                size
+                for other, size in self._held.items()
+                if other != key and other not in self._not_started
+            )
+            if self.reserved + extra > self.capacity and started:
+                return False
+            self._not_started.discard(key)
+            self._held[key] = held + extra
+            self.reserved += extra
+            self.high_water = max(self.high_water, self.reserved)
+            self._measure()
+            return True
+
+    def reserve(self, key: str, nbytes: int) -> None:
+        """Raise the space held for key to nbytes, waiting until it fits."""
+        while not self.try_reserve(key, nbytes):
+            self.wait()
+
+    async def reserve_async(self, key: str, nbytes: int) -> None:
+        """Raise the space held for key to nbytes, waiting in a thread."""
+        while not self.try_reserve(key, nbytes):
+            await to_thread(self.wait)
+
+    def release(self, key: str) -> None:
+        """Free all the space held for key."""
+        with self._changed:
+            self.reserved -= self._held.pop(key, 0)
+            self._not_started.discard(key)
+            self._measure()
+            self._changed.notify_all()
+
+    def wait(self) -> None:
+        """Block until space is released, or BUDGET_POLL seconds pass."""
+        with self._changed:
+            self._changed.wait(BUDGET_POLL)
+
+    def report(self) -> None:
+        """Log the high-water marks of projected and measured scratch space."""
+        logger.info(
+            "%s scratch high-water: %.1f GB projected, volume grew %.1f GB, "
+            "budget %.1f GB",
+            self.name,
+            self.high_water / _GB,
+            self._grown / _GB,
+            self.capacity / _GB,
+        )
+
+    def _measure(self) -> None:
+        """Track how far the volume usage grew since the budget was made."""
+        self._grown = max(self._grown, disk_usage(data_dir).used - self._baseline)
+
+
+def tile_scratch(size: int | None, *, stream: bool) -> int:
+    """Project the peak scratch space of a source tile from its .gz size.
+
+    Downloading keeps the .gz while it is decompressed, while streaming only
+    writes the sorted GeoParquet and its two variants, each about the size
+    of the .gz. A tile of unknown size counts as TILE_SIZE_UNKNOWN.
+    """
+    size = size or TILE_SIZE_UNKNOWN
+    if stream:
+        return 3 * size
+    return (1 + GZ_EXPANSION) * size
+
+
+def country_source_bytes(provider: str, iso3s: list[str]) -> dict[str, int]:
+    """Project the source bytes of each country from the manifest.
+
+    Each source file overlapping a country's bbox counts in proportion to
+    the share of its extent inside the bbox.
+    """
+    manifest = manifest_path(provider)
+    with engine() as con:
+        load_adm0(con)
+        rows = con.sql(f"""
+            SELECT
+                a.iso3,
+                sum(
+                    m.size
+                    * greatest(least(m.xmax, a.xmax) - greatest(m.xmin, a.xmin), 0)
+                    * greatest(least(m.ymax, a.ymax) - greatest(m.ymin, a.ymin), 0)
+                    / greatest((m.xmax - m.xmin) * (m.ymax - m.ymin), 1e-12)
+                )::BIGINT
+            FROM adm0 AS a
+            JOIN '{manifest}' AS m ON
+                m.xmax >= a.xmin AND
+                m.xmin <= a.xmax AND
+                m.ymax >= a.ymin AND
+                m.ymin <= a.ymax
+            WHERE a.iso3 IN (SELECT unnest({iso3s}))
+            GROUP BY a.iso3
+        """).fetchall()
+    return dict(rows)
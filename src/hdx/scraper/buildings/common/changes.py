@@ -0,0 +1,147 @@
+import logging
+import sqlite3
+from contextlib import closing
+from hashlib import sha256
+
+from .engine import engine, load_adm0
+from .manifest import build_manifest, manifest_path
+from .state import open_state
+
+logger = logging.getLogger(__name__)
+
+
+def changed_countries(provider: str, iso3s: list[str]) -> list[str]:
+    """Return the countries whose inputs changed since they were published.
+
+    A country's inputs are the source files whose extent overlaps its bbox,
+    each with its ETag, and the hash of its admin 0 boundary. The reason a
+    country is regrouped, or skipped, is logged.
+    """
+    current = _current_inputs(provider, iso3s)
+    changed = []
+    with closing(open_state()) as con:
+        for iso3 in iso3s:
+            reason = _change_reason(con, provider, iso3, current.get(iso3))
+            if reason:
+                logger.info("Regrouping %s: %s", iso3, reason)
+                changed.append(iso3)
+            else:
+                logger.info("Skipping %s: inputs unchanged", iso3)
+    return changed
+
+
+def record_country(provider: str, iso3: str, fingerprint: str) -> None:
+    """Record the inputs a country was just published from.
+
+    fingerprint is that of the inputs the country was grouped from. When the
+    inputs changed since, nothing is recorded so the country is regrouped on
+    the next run, rather than its outputs being taken as current.
+    """
+    current = _current_inputs(provider, [iso3]).get(iso3)
+    if current is None:
+        logger.warning("Not recording %s: not in the admin 0 boundaries", iso3)
+        return
+    if _fingerprint(*current) != fingerprint:
+        logger.warning("Inputs of %s changed while it was grouped", iso3)
+        return
+    adm0_hash, inputs = current
+    with closing(open_state()) as con, con:
+        con.execute(
+            "DELETE FROM country_inputs WHERE provider = ? AND iso3 = ?",
+            (provider, iso3),
+        )
+        con.executemany(
+            "INSERT INTO country_inputs VALUES (?, ?, ?, ?)",
+            [(provider, iso3, path, etag) for path, etag in inputs],
+        )
+        con.execute(
+            """
+            INSERT INTO countries (provider, iso3, adm0_hash) VALUES (?, ?, ?)
+            ON CONFLICT (provider, iso3) DO UPDATE SET
+                adm0_hash = excluded.adm0_hash,
+                updated = CURRENT_TIMESTAMP
+            """,
+            (provider, iso3, adm0_hash),
+        )
+
+
+def input_fingerprints(provider: str, iso3s: list[str]) -> dict[str, str]:
+    """Hash each country's boundary hash and source files with their ETags."""
+    return {
+        iso3: _fingerprint(adm0_hash, inputs)
+        for iso3, (adm0_hash, inputs) in _current_inputs(provider, iso3s).items()
+    }
+
+
+def _fingerprint(adm0_hash: str, inputs: set[tuple[str, str]]) -> str:
+    """Hash a boundary hash with source files and their ETags, in any order."""
+    digest = sha256(adm0_hash.encode())
+    for path, etag in sorted(inputs):
+        digest.update(f"\n{path} {etag}".encode())
+    return digest.hexdigest()
+
+
+def _current_inputs(
+    provider: str, iso3s: list[str]
+) -> dict[str, tuple[str, set[tuple[str, str]]]]:
+    """Map each country to its boundary hash and overlapping source files.
+
+    Countries missing from the admin 0 boundaries are left out.
+    """
+    manifest = manifest_path(provider)
+    if not manifest.exists():
+        build_manifest(provider)
+    with engine() as con:
+        load_adm0(con)
+        rows = con.sql(f"""
+            SELECT a.iso3, md5(ST_AsHEXWKB(a.geometry)), m.path, m.etag
+            FROM adm0 AS a
+            LEFT JOIN '{manifest}' AS m ON
+                m.xmax >= a.xmin AND
+                m.xmin <= a.xmax AND
+                m.ymax >= a.ymin AND
+                m.ymin <= a.ymax
+            WHERE a.iso3 IN (SELECT unnest({iso3s}))
+        """).fetchall()
+    inputs = {}
+    for iso3, adm0_hash, path, etag in rows:
+        inputs.setdefault(iso3, (adm0_hash, set()))
+        if path:
+            inputs[iso3][1].add((path, etag))
+    return inputs
+
+
+def _change_reason(
+    con: sqlite3.Connection,
+    provider: str,
+    iso3: str,
+    current: tuple[str, set[tuple[str, str]]] | None,
+) -> str | None:
+    """Describe how a country's inputs changed, or None if they did not."""
+    if current is None:
+        return "not in the admin 0 boundaries"
+    row = con.execute(
+        "SELECT adm0_hash FROM countries WHERE provider = ? AND iso3 = ?",
+        (provider, iso3),
+    ).fetchone()
+    if row is None:
+        return "no record of a previous publish"
+    adm0_hash, inputs = current
+    if row["adm0_hash"] != adm0_hash:
+        return "admin 0 boundary changed"
+    previous = dict(
+        con.execute(
+            "SELECT path, etag FROM country_inputs WHERE provider = ? AND iso3 = ?",
+            (provider, iso3),
+        ).fetchall()
+    )
+    paths = dict(inputs)
+    added = paths.keys() - previous.keys()
+    removed = previous.keys() - paths.keys()
+    updated = [x for x in paths.keys() & previous.keys() if paths[x] != previous[x]]
+    if not (added or removed or updated):
+        return None
+    return (
+        f"{len(added)} source files added, {len(removed)} removed, "
+        f"{len(updated)} changed"
+    )
@@ -20,6 +20,8 @@ RUN_MICROSOFT = _is_bool_env(getenv("RUN_MICROSOFT", "NO"))
 
 AWS_ENDPOINT_URL = "https://data.source.coop"
 AWS_ENDPOINT_S3 = "us-west-2.opendata.source.coop"
+AWS_REGION = "us-west-2"
+S3_VARIANTS = ["geoparquet-2.0", "geoparquet-1.1", "parquet"]
 
 ARCGIS_SERVER = getenv("ARCGIS_SERVER", "https://gis.unocha.org")
 ARCGIS_USERNAME = getenv("ARCGIS_USERNAME", "")
@@ -33,11 +35,42 @@ WAIT = 10  # 10 seconds
 TIMEOUT = 60 * 60  # 1 hour
 
 CONCURRENCY_LIMIT = int(getenv("CONCURRENCY_LIMIT", str(cpu_count())))
+DOWNLOAD_LIMIT = int(getenv("DOWNLOAD_LIMIT", str(CONCURRENCY_LIMIT)))  # at most
+DECOMPRESS_LIMIT = int(getenv("DECOMPRESS_LIMIT", "2"))
+CONVERT_LIMIT = int(getenv("CONVERT_LIMIT", str(cpu_count())))
+UPLOAD_LIMIT = int(getenv("UPLOAD_LIMIT", str(CONCURRENCY_LIMIT)))  # at most
+STAGE_QUEUE_SIZE = int(getenv("STAGE_QUEUE_SIZE", "2"))  # tiles between stages
+ADAPT_INTERVAL = 30  # seconds of throughput compared to adjust a limit
+ADAPT_GAIN = 0.05  # relative change in throughput that moves a limit
+
+DISK_BUDGET_GB = float(getenv("DISK_BUDGET_GB", "0"))  # 0 for 90% of free space
+BUDGET_POLL = 5  # seconds between checks for scratch space
+GZ_EXPANSION = 5  # decompressed size of a source tile over its .gz size
+TILE_SIZE_UNKNOWN = 1024 * 1024 * 1024  # 1 GB, .gz size when not given
+COUNTRY_SCRATCH_RATIO = 6  # peak grouping space over a country's source bytes
+DOWNLOAD_RANGES = int(getenv("DOWNLOAD_RANGES", "1"))  # parallel ranges per file
+DOWNLOAD_RANGE_MIN = 256 * 1024 * 1024  # 256 MB, smallest file split in ranges
+DOWNLOAD_STATE_INTERVAL = 16 * 1024 * 1024  # 16 MB between saves of progress
+GROUPING_WORKERS = int(getenv("GROUPING_WORKERS", "1"))
+PUBLISH_QUEUE_SIZE = int(getenv("PUBLISH_QUEUE_SIZE", "2"))
+PUBLISH_WORKERS = int(getenv("PUBLISH_WORKERS", "4"))  # countries published at once
+UPLOAD_INFLIGHT_MB = int(getenv("UPLOAD_INFLIGHT_MB", "1024"))  # across all uploads
+UPLOAD_PART_SIZE = 64 * 1024 * 1024  # 64 MB
+
+DUCKDB_THREADS = int(getenv("DUCKDB_THREADS", "0"))  # 0 for a share of the cores
+DUCKDB_MEMORY_LIMIT = getenv("DUCKDB_MEMORY_LIMIT", "")  # e.g. 8GB, per process
+EXTRACT_TILE_MB = int(getenv("EXTRACT_TILE_MB", "4096"))  # 0 to never use tiles
+EXTRACT_TILE_WORKERS = int(getenv("EXTRACT_TILE_WORKERS", "4"))
+USAGE_INTERVAL = 1  # seconds between samples of memory and spill
 
 HDX_MAX_SIZE = 1.5 * 1024 * 1024 * 1024  # 1.5 GB
+SIZE_SAMPLE_ROWS = 200_000  # rows converted to estimate a country's zip size
+SIZE_ESTIMATE_MARGIN = 0.2  # relative error allowed on that estimate
 
 RUN_DOWNLOAD = _is_bool_env(getenv("RUN_DOWNLOAD", "NO"))
+STREAM_INGEST = _is_bool_env(getenv("STREAM_INGEST", "NO"))
 RUN_GROUPING = _is_bool_env(getenv("RUN_GROUPING", "YES"))
+RUN_PARTITION = _is_bool_env(getenv("RUN_PARTITION", "YES"))
 
 ISO_3_LEN = 3
 
@@ -52,4 +85,18 @@ cwd = Path(__file__).parent
 data_dir = cwd / "../../../../../saved_data"
 data_dir.mkdir(exist_ok=True, parents=True)
 
+STATE_DB = data_dir / "state.sqlite"  # source tile versions already published
+DUCKDB_TEMP = data_dir / "duckdb_tmp"  # spill files, in one folder per process
+
 GLOBAL_ADM0 = data_dir / "bnda_cty.parquet"
+ADM0_CACHE = data_dir / "adm0_cache"
+ADM0_PAGE_SIZE = 25  # features per query, capped by the layer's maxRecordCount
+ADM0_WORKERS = 8  # pages queried at once
+ADM0_PIECE_VERTICES = 256  # split country pieces until below this many points
+ADM0_CELL_SIZE = 0.5  # degrees, largest cell left on a country boundary
+ADM0_MAX_DEPTH = 16  # for a quadtree over the country bbox
+
+SOURCE_PARQUET = (
+    f"s3://{AWS_ENDPOINT_S3}/hdx/{{provider}}-open-buildings"
+    "/geoparquet-2.0/**/*_buildings.parquet"
+)
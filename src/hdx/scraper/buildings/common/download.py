@@ -1,34 +1,160 @@
 import gzip
+import json
+import logging
 import shutil
-from asyncio import create_subprocess_shell
-from asyncio.subprocess import PIPE
+from asyncio import TaskGroup, create_subprocess_shell, to_thread
 from pathlib import Path
+from typing import BinaryIO
 
-from httpx import AsyncClient
+from httpx import AsyncClient, codes
 from tenacity import retry, stop_after_attempt, wait_fixed
 
-from .config import ATTEMPT, AWS_ENDPOINT_S3, WAIT
+from .config import (
+    ATTEMPT,
+    DOWNLOAD_RANGE_MIN,
+    DOWNLOAD_RANGES,
+    DOWNLOAD_STATE_INTERVAL,
+    WAIT,
+)
+from .pipeline import AdaptiveLimit
+from .s3 import abort_uploads, upload_file
+
+logger = logging.getLogger(__name__)
 
 
 @retry(stop=stop_after_attempt(ATTEMPT), wait=wait_fixed(WAIT))
-async def download_gz(client: AsyncClient, url: str, output_path: Path) -> None:
-    """Download a large file from a URL in chunks using httpx."""
-    output_zip = output_path.with_suffix(output_path.suffix + ".gz")
+async def download_gz(
+    client: AsyncClient, url: str, output_path: Path, limit: AdaptiveLimit
+) -> None:
+    """Download a large file from a URL in chunks using httpx.
+
+    Each attempt holds a slot of limit, and a retry resumes from the bytes a
+    failed attempt already wrote, see _download_ranges.
+    """
     output_path.parent.mkdir(exist_ok=True, parents=True)
-    output_path.unlink(missing_ok=True)  # noqa: ASYNC240
-    output_zip.unlink(missing_ok=True)
-    with output_zip.open("wb") as f:
-        async with client.stream("GET", url) as r:
-            r.raise_for_status()
-            async for chunk in r.aiter_bytes():
-                f.write(chunk)
-    with gzip.open(output_zip, "rb") as f_in, output_path.open("wb") as f_out:
+    async with limit.acquire():
+        await _download_ranges(client, url, output_path, limit)
+
+
+def decompress_gz(input_path: Path, output_path: Path) -> None:
+    """Decompress a downloaded .gz file, then remove it."""
+    with gzip.open(input_path, "rb") as f_in, output_path.open("wb") as f_out:
         shutil.copyfileobj(f_in, f_out)
-    output_zip.unlink(missing_ok=True)
+    input_path.unlink()
+
+
+async def _download_ranges(
+    client: AsyncClient, url: str, output_path: Path, limit: AdaptiveLimit
+) -> None:
+    """Download a file with Range requests that resume after a failure.
+
+    Progress is kept next to the file as the ETag (or Last-Modified), size
+    and the next byte of each range. A later attempt resumes only when both
+    still match the server, and If-Range makes a file that changed mid-way
+    fail fast instead of mixing versions. Files of DOWNLOAD_RANGE_MIN bytes
+    or more are split into DOWNLOAD_RANGES ranges fetched at once.
+    """
+    state_path = output_path.with_name(output_path.name + ".json")
+    r = await client.head(url)
+    r.raise_for_status()
+    validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+    size = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+    state = _load_state(state_path, output_path, validator, size)
+    with output_path.open("r+b") as f:
+        async with TaskGroup() as tg:
+            for byte_range in state["ranges"]:
+                tg.create_task(
+                    _fetch_range(client, url, f, byte_range, state, state_path, limit)
+                )
+    _check_size(output_path, state_path, size)
+
+
+def _load_state(
+    state_path: Path, output_path: Path, validator: str | None, size: int | None
+) -> dict:
+    """Return the saved progress of a download, or start it from scratch."""
+    if validator and state_path.exists() and output_path.exists():
+        state = json.loads(state_path.read_text())
+        if (state["validator"], state["size"]) == (validator, size):
+            logger.info("Resuming download of %s", output_path.name)
+            return state
+    num_ranges = 1
+    if size and validator and size >= DOWNLOAD_RANGE_MIN:
+        num_ranges = DOWNLOAD_RANGES
+    output_path.write_bytes(b"")
+    return {
+        "validator": validator,
+        "size": size,
+        "ranges": _split_ranges(size, num_ranges),
+    }
+
+
+def _check_size(output_path: Path, state_path: Path, size: int | None) -> None:
+    """Check a finished download against its size, then drop its progress."""
+    if size is not None and output_path.stat().st_size != size:
+        msg = f"{output_path.name} is {output_path.stat().st_size} of {size} bytes"
+        raise ValueError(msg)
+    state_path.unlink(missing_ok=True)
+
+
+def _split_ranges(size: int | None, num_ranges: int) -> list[list[int | None]]:
+    """Split a file into contiguous [next byte, last byte] ranges."""
+    if size is None:
+        return [[0, None]]
+    step = -(-size // num_ranges)
+    return [[x, min(x + step, size) - 1] for x in range(0, size, step)] or [[0, -1]]
+
+
+async def _fetch_range(  # noqa: PLR0913
+    client: AsyncClient,
+    url: str,
+    f: BinaryIO,
+    byte_range: list[int | None],
+    state: dict,
+    state_path: Path,
+    limit: AdaptiveLimit,
+) -> None:
+    """Fetch the rest of one byte range, saving progress as it goes."""
+    start, end = byte_range
+    if end is not None and start > end:
+        return
+    headers = {}
+    if end is not None:
+        headers["Range"] = f"bytes={start}-{end}"
+        if state["validator"]:
+            headers["If-Range"] = state["validator"]
+    async with client.stream("GET", url, headers=headers) as r:
+        r.raise_for_status()
+        if r.status_code != codes.PARTIAL_CONTENT and (
+            start != 0 or end not in (None, (state["size"] or 0) - 1)
+        ):
+            state_path.unlink(missing_ok=True)  # noqa: ASYNC240
+            msg = f"{url} changed during download"
+            raise ValueError(msg)
+        saved = start
+        try:
+            async for chunk in r.aiter_raw():
+                f.seek(start)
+                f.write(chunk)
+                start += len(chunk)
+                limit.record(len(chunk))
+                byte_range[0] = start
+                if start - saved >= DOWNLOAD_STATE_INTERVAL:
+                    saved = start
+                    _save_state(f, state, state_path)
+        finally:
+            _save_state(f, state, state_path)
+
+
+def _save_state(f: BinaryIO, state: dict, state_path: Path) -> None:
+    """Record download progress, after the bytes it covers are written."""
+    f.flush()
+    if state["validator"]:
+        state_path.write_text(json.dumps(state))
 
 
 async def vector_to_geoparquet(
-    input_path: Path,
+    input_path: Path | str,
     output_path: Path,
     *,
     use_parquet_geo_types: str | None = "YES",
@@ -56,7 +182,7 @@ async def vector_to_geoparquet(
 
 
 async def csv_to_geoparquet(
-    input_path: Path,
+    input_path: Path | str,
     output_path: Path,
     columns: str,
     *,
@@ -92,33 +218,52 @@ async def csv_to_geoparquet(
         raise ValueError
 
 
-async def s3_file_exists(provider: str, subfolder: str, filename: str) -> bool:
-    """Check whether a file already exists in S3-compatible storage."""
-    prefix = f"{subfolder}/" if subfolder else ""
-    s3_path = f"s3://{AWS_ENDPOINT_S3}/hdx/{provider}-open-buildings/{prefix}{filename}"
-    cmd = ["aws", "s3", "ls", s3_path]
-    process = await create_subprocess_shell(" ".join(cmd), stdout=PIPE)
-    stdout, _ = await process.communicate()
-    return bool(stdout.strip())
+@retry(stop=stop_after_attempt(ATTEMPT), wait=wait_fixed(WAIT))
+async def stream_gz_to_geoparquet(
+    url: str, output_path: Path, driver: str, columns: str | None = None
+) -> None:
+    """Convert a remote .gz file to a bbox sorted GeoParquet as it downloads.
+
+    GDAL reads the HTTP body through /vsicurl_streaming/ and inflates it
+    through /vsigzip/, so neither the .gz nor the decompressed file is
+    written to disk. A driver that rewinds its input restarts the request.
+    The driver prefix is needed as the remote name always ends in .csv.gz.
+    """
+    input_path = f"{driver}:/vsigzip//vsicurl_streaming/{url}"
+    if columns:
+        await csv_to_geoparquet(
+            input_path,
+            output_path,
+            columns,
+            use_parquet_geo_types="YES",
+            sort_by_bbox=True,
+        )
+    else:
+        await vector_to_geoparquet(
+            input_path,
+            output_path,
+            use_parquet_geo_types="YES",
+            sort_by_bbox=True,
+        )
+
+
+async def upload_to_s3(output_path: Path, key: str, limit: AdaptiveLimit) -> None:
+    """Upload a file to S3 compatible storage.
+
+    Each attempt holds a slot of limit, and a retry resumes a multipart
+    upload from the parts already uploaded. Once every attempt has failed,
+    the incomplete upload is aborted rather than left to be billed.
+    """
+    try:
+        await _upload_attempt(output_path, key, limit)
+    except Exception:
+        await to_thread(abort_uploads, key)
+        raise
 
 
 @retry(stop=stop_after_attempt(ATTEMPT), wait=wait_fixed(WAIT))
-async def upload_to_s3(
-    provider: str,
-    output_dir: Path,
-    output_path: Path,
-    subfolder: str = "",
-    s3_name: str | None = None,
-) -> None:
-    """Upload a file to S3 compatible storage."""
-    relative_path = s3_name or output_path.relative_to(output_dir)
-    prefix = f"{subfolder}/" if subfolder else ""
-    cmd = [
-        *["aws", "s3", "cp"],
-        str(output_path),
-        f"s3://{AWS_ENDPOINT_S3}/hdx/{provider}-open-buildings/{prefix}{relative_path}",
-    ]
-    process = await create_subprocess_shell(" ".join(cmd))
-    returncode = await process.wait()
-    if returncode != 0:
-        raise ValueError
+async def _upload_attempt(output_path: Path, key: str, limit: AdaptiveLimit) -> None:
+    """Upload a file in a slot of limit, recording its bytes."""
+    async with limit.acquire():
+        await to_thread(upload_file, output_path, key)
+        limit.record(output_path.stat().st_size)  # noqa: ASYNC240
@@ -0,0 +1,140 @@
+import logging
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from functools import cache
+from multiprocessing import cpu_count
+from os import getpid, sysconf
+from pathlib import Path
+from shutil import rmtree
+from threading import Event, Thread
+
+from duckdb import DuckDBPyConnection, connect
+
+from .config import (
+    ADM0_CACHE,
+    DUCKDB_MEMORY_LIMIT,
+    DUCKDB_TEMP,
+    DUCKDB_THREADS,
+    GROUPING_WORKERS,
+    USAGE_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+_GB = 1024 * 1024 * 1024
+_SIZE_UNITS = {"bytes": 1, "KiB": 1024, "MiB": 1024**2, "GiB": 1024**3, "TiB": 1024**4}
+_processes = 1  # sharing the machine, GROUPING_WORKERS in a grouping worker
+
+
+def use_worker_share() -> None:
+    """Size the DuckDB session of this process as one of GROUPING_WORKERS."""
+    global _processes  # noqa: PLW0603
+    _processes = GROUPING_WORKERS
+
+
+@cache
+def _engine(pid: int) -> DuckDBPyConnection:
+    """Open the DuckDB session shared by every query in process pid.
+
+    Keyed on pid so a forked worker never reuses its parent's session. Unless
+    set, threads and memory_limit default to DuckDB's own, or in a grouping
+    worker to a share of them for each of GROUPING_WORKERS, and spill goes
+    to a folder of the process under DUCKDB_TEMP, so workers side by side
+    cannot run out of memory together.
+    """
+    con = connect()
+    con.sql("""
+        INSTALL spatial; LOAD spatial;
+        INSTALL httpfs; LOAD httpfs;
+        CREATE SECRET (TYPE s3, KEY_ID '', SECRET '');
+        SET GLOBAL enable_http_metadata_cache = true;
+        SET GLOBAL parquet_metadata_cache = true;
+    """)
+    threads = DUCKDB_THREADS or max(1, cpu_count() // _processes)
+    con.sql(f"SET GLOBAL threads = {threads};")
+    memory_limit = DUCKDB_MEMORY_LIMIT or _memory_share(con)
+    con.sql(f"SET GLOBAL memory_limit = '{memory_limit}';")
+    temp_dir = _temp_dir(pid)
+    rmtree(temp_dir, ignore_errors=True)
+    temp_dir.mkdir(parents=True)
+    con.sql(f"SET GLOBAL temp_directory = '{temp_dir}';")
+    return con
+
+
+def _memory_share(con: DuckDBPyConnection) -> str:
+    """Divide DuckDB's default memory_limit among the processes sharing it."""
+    row = con.sql("SELECT current_setting('memory_limit')").fetchone()
+    value, unit = row[0].split() if row else ("0", "bytes")
+    share = float(value) * _SIZE_UNITS[unit] / _processes
+    return f"{int(share / _SIZE_UNITS['MiB'])}MiB"
+
+
+def _temp_dir(pid: int) -> Path:
+    """Return the folder DuckDB spills to in process pid."""
+    return DUCKDB_TEMP / str(pid)
+
+
+def engine() -> DuckDBPyConnection:
+    """Return a new cursor on the shared DuckDB session.
+
+    Extensions, the S3 secret and caches are set up once per process, so
+    callers can open and close cursors freely.
+    """
+    return _engine(getpid()).cursor()
+
+
+@contextmanager
+def report_usage(label: str) -> Iterator[None]:
+    """Log the peak RSS of this process and DuckDB spill during the block.
+
+    Both are sampled every USAGE_INTERVAL seconds from a background thread.
+    """
+    peak = {"rss": 0, "spill": 0}
+    done = Event()
+    temp_dir = _temp_dir(getpid())
+
+    def sample() -> None:
+        while True:
+            peak["rss"] = max(peak["rss"], _rss())
+            peak["spill"] = max(peak["spill"], _dir_size(temp_dir))
+            if done.wait(USAGE_INTERVAL):
+                return
+
+    sampler = Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        done.set()
+        sampler.join()
+        logger.info(
+            "%s peak RSS %.2f GB, spilled %.2f GB",
+            label,
+            peak["rss"] / _GB,
+            peak["spill"] / _GB,
+        )
+
+
+def _rss() -> int:
+    """Return the resident memory of this process in bytes."""
+    pages = Path("/proc/self/statm").read_text().split()[1]
+    return int(pages) * sysconf("SC_PAGE_SIZE")
+
+
+def _dir_size(path: Path) -> int:
+    """Return the bytes of the files under path, as DuckDB adds and drops them."""
+    size = 0
+    for file in path.rglob("*"):
+        with suppress(FileNotFoundError):
+            size += file.stat().st_size if file.is_file() else 0
+    return size
+
+
+def load_adm0(con: DuckDBPyConnection) -> None:
+    """Load the cached country geometries as tables adm0 and adm0_pieces."""
+    con.sql(f"""
+        CREATE TABLE IF NOT EXISTS adm0 AS
+        FROM '{ADM0_CACHE / "countries.parquet"}';
+        CREATE TABLE IF NOT EXISTS adm0_pieces AS
+        FROM '{ADM0_CACHE / "pieces.parquet"}';
+    """)
@@ -0,0 +1,55 @@
+import logging
+from math import ceil
+from pathlib import Path
+
+from .config import HDX_MAX_SIZE, SIZE_ESTIMATE_MARGIN, SIZE_SAMPLE_ROWS
+from .engine import engine
+from .gdb import parquet_to_gdb_zip, remove_gdb_zip
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_zip_size(input_gpq: Path, output_dir: Path, total_rows: int) -> float:
+    """Predict the .gdb.zip size of a parquet from a sampled conversion.
+
+    Converts a reservoir sample of SIZE_SAMPLE_ROWS rows and scales its
+    zipped size by the full row count.
+    """
+    sample_gpq = output_dir / "sample.parquet"
+    with engine() as con:
+        con.sql(f"""
+            COPY (
+                SELECT * FROM '{input_gpq}'
+                USING SAMPLE reservoir({SIZE_SAMPLE_ROWS} ROWS) REPEATABLE (0)
+            )
+            TO '{sample_gpq}'
+            WITH (COMPRESSION zstd);
+        """)
+    sample_zip = parquet_to_gdb_zip(sample_gpq, output_dir / "sample.gdb")
+    sample_size = sample_zip.stat().st_size
+    remove_gdb_zip(sample_zip)
+    sample_gpq.unlink()
+    return sample_size * total_rows / SIZE_SAMPLE_ROWS
+
+
+def estimate_num_parts(input_gpq: Path, output_dir: Path) -> int | None:
+    """Plan how many parts a country needs to fit within HDX_MAX_SIZE.
+
+    Returns None when the estimate is too close to HDX_MAX_SIZE to tell
+    whether one part is enough, so the caller should build and measure.
+    Countries no bigger than the sample are assumed to fit in one part.
+    """
+    with engine() as con:
+        row = con.sql(f"SELECT count(*) FROM '{input_gpq}'").fetchone()
+    total_rows = row[0] if row else 0
+    if total_rows <= SIZE_SAMPLE_ROWS:
+        return 1
+    estimate = estimate_zip_size(input_gpq, output_dir, total_rows)
+    low = ceil(estimate * (1 - SIZE_ESTIMATE_MARGIN) / HDX_MAX_SIZE)
+    high = ceil(estimate * (1 + SIZE_ESTIMATE_MARGIN) / HDX_MAX_SIZE)
+    logger.info("Estimated %s at %d bytes", input_gpq.name, estimate)
+    if high <= 1:
+        return 1
+    if low <= 1:
+        return None
+    return high
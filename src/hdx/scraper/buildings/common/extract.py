@@ -1,51 +1,203 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import product
+from math import ceil, sqrt
 from pathlib import Path
+from shutil import rmtree
 
-from duckdb import connect
+from duckdb import DuckDBPyConnection
 
-from .config import GLOBAL_ADM0
+from .config import EXTRACT_TILE_MB, EXTRACT_TILE_WORKERS
+from .engine import engine, load_adm0
+from .manifest import overlapping_bytes, overlapping_files, source_list
 
 logger = logging.getLogger(__name__)
 
+_MB = 1024 * 1024
 
-def extract_country_buildings(iso3: str, input_path: str, output_gpq: Path) -> bool:
+
+def intersecting_buildings(source: str, iso3s: list[str], where: str = "true") -> str:
+    """Return a query for the buildings in source intersecting the countries.
+
+    Each building is paired with the country pieces whose cell its bbox
+    overlaps. A building strictly inside a cell is accepted outright when the
+    cell is inside the country, and otherwise tested against that cell's
+    piece alone. One crossing a cell edge is tested against the whole
+    country, once, from the cell holding its bbox corner clamped to the
+    country bbox, so no building is returned twice for a country.
+    """
+    iso3_list = ",".join(f"'{iso3}'" for iso3 in iso3s)
+    return f"""
+        SELECT b.* RENAME (geometry_bbox AS bbox), p.iso3
+        FROM (
+            SELECT * FROM read_parquet({source})
+            WHERE {where}
+        ) AS b
+        JOIN (
+            SELECT * FROM adm0_pieces WHERE iso3 IN ({iso3_list})
+        ) AS p ON ST_Intersects(
+            ST_MakeEnvelope(
+                b.geometry_bbox.xmin,
+                b.geometry_bbox.ymin,
+                b.geometry_bbox.xmax,
+                b.geometry_bbox.ymax
+            ),
+            p.cell
+        )
+        JOIN adm0 AS a ON a.iso3 = p.iso3
+        WHERE CASE
+            WHEN
+                b.geometry_bbox.xmin > p.cx0 AND
+                b.geometry_bbox.xmax < p.cx1 AND
+                b.geometry_bbox.ymin > p.cy0 AND
+                b.geometry_bbox.ymax < p.cy1
+            THEN p.status = 'inside' OR (
+                p.status = 'boundary' AND ST_Intersects(b.geometry, p.geometry)
+            )
+            ELSE
+                greatest(b.geometry_bbox.xmin, a.xmin) >= p.cx0 AND
+                greatest(b.geometry_bbox.xmin, a.xmin) < p.cx1 AND
+                greatest(b.geometry_bbox.ymin, a.ymin) >= p.cy0 AND
+                greatest(b.geometry_bbox.ymin, a.ymin) < p.cy1 AND
+                ST_Intersects(b.geometry, a.geometry)
+        END
+    """
+
+
+def extract_country_buildings(
+    iso3: str, input_path: str, output_gpq: Path, manifest: Path | None = None
+) -> bool:
     """Fetch buildings for a country from S3 and write to a local parquet.
 
     Returns False if no source files overlap the country bbox.
     Uses a Python round-trip to fetch bbox values before the COPY query.
+    When a manifest is given, only the files it lists as overlapping the
+    country bbox are read instead of the whole input_path glob, and a
+    country whose files add up to more than EXTRACT_TILE_MB is extracted
+    in tiles, see _extract_tiles.
     """
-    with connect() as con:
-        con.sql(f"""
-            INSTALL spatial; LOAD spatial;
-            INSTALL httpfs; LOAD httpfs;
-            CREATE SECRET (TYPE s3, KEY_ID '', SECRET '');
-            CREATE TEMP TABLE adm0 AS
-            SELECT
-                ST_MemUnion_Agg(geometry) AS geometry,
-                min(ST_XMin(geometry)) AS xmin,
-                min(ST_YMin(geometry)) AS ymin,
-                max(ST_XMax(geometry)) AS xmax,
-                max(ST_YMax(geometry)) AS ymax
-            FROM '{GLOBAL_ADM0}'
-            WHERE iso3cd = '{iso3}'
-            GROUP BY iso3cd;
-        """)
-        xmin, ymin, xmax, ymax = con.sql(
-            "SELECT xmin, ymin, xmax, ymax FROM adm0"
-        ).fetchone()  # type: ignore  # noqa: PGH003
+    with engine() as con:
+        load_adm0(con)
+        bbox = con.sql(
+            f"SELECT xmin, ymin, xmax, ymax FROM adm0 WHERE iso3 = '{iso3}'"
+        ).fetchone()
+        if not bbox:
+            logger.error("Country not found in admin 0 for %s", iso3)
+            return False
+        source = f"'{input_path}'"
+        if manifest and manifest.exists():
+            files = overlapping_files(con, manifest, bbox)
+            if not files:
+                logger.info("No source files overlap %s", iso3)
+                return False
+            if EXTRACT_TILE_MB:
+                size = overlapping_bytes(con, manifest, bbox)
+                num_tiles = ceil(size / (EXTRACT_TILE_MB * _MB))
+                if num_tiles > 1:
+                    return _extract_tiles(iso3, bbox, manifest, output_gpq, num_tiles)
+            source = source_list(files)
+        _copy_buildings(con, iso3, source, bbox, output_gpq)
+        count = con.sql(f"SELECT count(*) FROM '{output_gpq}'").fetchone()
+    return bool(count and count[0] > 0)
+
+
+def _extract_tiles(
+    iso3: str,
+    bbox: tuple[float, float, float, float],
+    manifest: Path,
+    output_gpq: Path,
+    num_tiles: int,
+) -> bool:
+    """Extract a country in a grid of about num_tiles tiles over its bbox.
+
+    A building belongs to the tile holding the min corner of its bbox, with
+    the outer tiles open towards the outside, so each building is taken by
+    exactly one tile. EXTRACT_TILE_WORKERS tiles are extracted at once, each
+    from the source files overlapping the tile alone, so the memory of the
+    spatial join is bounded by a tile, not the country.
+
+    The tiles are then combined into output_gpq, which is estimated and
+    split into parts as any other country, rather than fed into the parts
+    directly. Only a country that fits in one part is converted whole.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    cols = ceil(sqrt(num_tiles))
+    rows = ceil(num_tiles / cols)
+    xs = [xmin + (xmax - xmin) * i / cols for i in range(cols + 1)]
+    ys = [ymin + (ymax - ymin) * j / rows for j in range(rows + 1)]
+    tiles_dir = output_gpq.with_suffix(".tiles")
+    rmtree(tiles_dir, ignore_errors=True)
+    tiles_dir.mkdir(parents=True)
+    logger.info("Extracting %s in %d x %d tiles", iso3, cols, rows)
+    extract_tile = partial(_extract_tile, iso3, bbox, manifest, xs, ys, tiles_dir)
+    with ThreadPoolExecutor(EXTRACT_TILE_WORKERS) as pool:
+        list(pool.map(extract_tile, product(range(cols), range(rows))))
+    with engine() as con:
         con.sql(f"""
-            COPY (
-                SELECT * RENAME (geometry_bbox AS bbox)
-                FROM read_parquet('{input_path}')
-                WHERE
-                    geometry_bbox.xmax >= {xmin} AND
-                    geometry_bbox.xmin <= {xmax} AND
-                    geometry_bbox.ymax >= {ymin} AND
-                    geometry_bbox.ymin <= {ymax} AND
-                    ST_Intersects(geometry, (SELECT geometry FROM adm0))
-            )
+            COPY (SELECT * FROM read_parquet('{tiles_dir}/*.parquet'))
             TO '{output_gpq}'
             WITH (COMPRESSION zstd);
         """)
         count = con.sql(f"SELECT count(*) FROM '{output_gpq}'").fetchone()
+    rmtree(tiles_dir)
     return bool(count and count[0] > 0)
+
+
+def _extract_tile(  # noqa: PLR0913
+    iso3: str,
+    bbox: tuple[float, float, float, float],
+    manifest: Path,
+    xs: list[float],
+    ys: list[float],
+    tiles_dir: Path,
+    tile: tuple[int, int],
+) -> None:
+    """Write the buildings whose bbox min corner falls in one tile."""
+    i, j = tile
+    tile_bbox = (xs[i], ys[j], xs[i + 1], ys[j + 1])
+    with engine() as con:
+        files = overlapping_files(con, manifest, tile_bbox)
+        if not files:
+            return
+        x_bounds, y_bounds = _open_bounds(xs), _open_bounds(ys)
+        corner = f"""
+            geometry_bbox.xmin >= {x_bounds[i]} AND
+            geometry_bbox.xmin < {x_bounds[i + 1]} AND
+            geometry_bbox.ymin >= {y_bounds[j]} AND
+            geometry_bbox.ymin < {y_bounds[j + 1]}
+        """
+        output = tiles_dir / f"tile_{i}_{j}.parquet"
+        _copy_buildings(con, iso3, source_list(files), bbox, output, corner)
+
+
+def _open_bounds(edges: list[float]) -> list[str]:
+    """Return grid edges as SQL, with the outermost ones open to infinity."""
+    return ["'-inf'::DOUBLE", *(str(x) for x in edges[1:-1]), "'inf'::DOUBLE"]
+
+
+def _copy_buildings(  # noqa: PLR0913
+    con: DuckDBPyConnection,
+    iso3: str,
+    source: str,
+    bbox: tuple[float, float, float, float],
+    output_gpq: Path,
+    where: str = "true",
+) -> None:
+    """Write the buildings of a country in source, and where, to a parquet."""
+    xmin, ymin, xmax, ymax = bbox
+    where = f"""
+        geometry_bbox.xmax >= {xmin} AND
+        geometry_bbox.xmin <= {xmax} AND
+        geometry_bbox.ymax >= {ymin} AND
+        geometry_bbox.ymin <= {ymax} AND
+        {where}
+    """
+    con.sql(f"""
+        COPY (
+            SELECT * EXCLUDE (iso3)
+            FROM ({intersecting_buildings(source, [iso3], where)})
+        )
+        TO '{output_gpq}'
+        WITH (COMPRESSION zstd);
+    """)
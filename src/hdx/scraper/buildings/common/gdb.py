@@ -0,0 +1,48 @@
+from pathlib import Path
+from shutil import rmtree
+from subprocess import run
+
+from .archive import zip_directory
+
+
+def parquet_to_gdb(input_gpq: Path, output_gdb: Path) -> None:
+    """Convert a parquet to a File Geodatabase."""
+    run(["gdal", "vector", "convert", input_gpq, output_gdb, "--quiet"], check=False)
+
+
+def zip_gdb(output_gdb: Path) -> Path:
+    """Zip a File Geodatabase next to it and remove the GDB directory.
+
+    The content hash of the zip is written beside it, see content_hash.
+    """
+    output_gdb_zip = output_gdb.with_suffix(".gdb.zip")
+    digest = zip_directory(output_gdb, output_gdb_zip)
+    _content_hash_path(output_gdb_zip).write_text(digest)
+    rmtree(output_gdb)
+    return output_gdb_zip
+
+
+def content_hash(output_gdb_zip: Path) -> str | None:
+    """Return the hash of the GDB contents of a zip, taken while zipping it."""
+    hash_path = _content_hash_path(output_gdb_zip)
+    return hash_path.read_text() if hash_path.exists() else None
+
+
+def remove_gdb_zip(output_gdb_zip: Path) -> None:
+    """Remove a zipped File Geodatabase and its content hash."""
+    output_gdb_zip.unlink()
+    _content_hash_path(output_gdb_zip).unlink(missing_ok=True)
+
+
+def _content_hash_path(output_gdb_zip: Path) -> Path:
+    """Return the path of the content hash kept beside a zip."""
+    return output_gdb_zip.with_name(output_gdb_zip.name + ".sha256")
+
+
+def parquet_to_gdb_zip(input_gpq: Path, output_gdb: Path) -> Path:
+    """Convert a parquet to a File Geodatabase and zip it next to the GDB.
+
+    Returns the path of the .gdb.zip, the GDB directory itself is removed.
+    """
+    parquet_to_gdb(input_gpq, output_gdb)
+    return zip_gdb(output_gdb)
@@ -1,28 +1,154 @@
+import logging
+from math import ceil
 from pathlib import Path
-from shutil import make_archive, rmtree
-from subprocess import run
+from shutil import rmtree
 
-from .config import AWS_ENDPOINT_S3, HDX_MAX_SIZE
+from hdx.utilities.easy_logging import setup_logging
+
+from .config import HDX_MAX_SIZE, SOURCE_PARQUET
+from .engine import report_usage, use_worker_share
+from .estimate import estimate_num_parts
 from .extract import extract_country_buildings
+from .gdb import parquet_to_gdb, remove_gdb_zip, zip_gdb
+from .journal import CONVERTED, EXTRACTED, ZIPPED, journal_stage, record_stage
+from .manifest import manifest_path
+from .partition import read_partition
 from .split import split_into_parts
 
+logger = logging.getLogger(__name__)
 
-def group(provider: str, iso3: str, output_dir: Path) -> None:
-    """Create a zipped File Geodatabase for a given country."""
-    input_path = f"s3://{AWS_ENDPOINT_S3}/hdx/{provider}-open-buildings/geoparquet-2.0/**/*_buildings.parquet"
-    output_name = f"{iso3.lower()}_buildings"
-    rmtree(output_dir, ignore_errors=True)
-    output_dir.mkdir(exist_ok=True, parents=True)
-    output_gpq = output_dir / f"{output_name}.parquet"
-    output_gdb = output_dir / f"{output_name}.gdb"
-    output_gdb_zip = output_dir / f"{output_name}.gdb.zip"
-    if not extract_country_buildings(iso3, input_path, output_gpq):
+
+def group(
+    provider: str,
+    iso3: str,
+    output_dir: Path,
+    partition_dir: Path | None = None,
+    fingerprint: str = "",
+) -> None:
+    """Create a zipped File Geodatabase for a given country.
+
+    Reads from partition_dir when the partition stage has run, otherwise
+    extracts the country from the source parquet set. The number of parts is
+    estimated up front, and the whole country is only converted when it is
+    expected to fit in one part or the estimate is too close to call.
+
+    Each stage completed is journaled against the fingerprint of the
+    country's inputs, so a later run from the same inputs resumes after the
+    last one with the files it left in output_dir, or starts again if they
+    are gone.
+    """
+    output_gpq, output_gdb = _output_paths(iso3, output_dir)
+    stage = resume_stage(provider, iso3, output_dir, fingerprint)
+    if stage == ZIPPED:
         return
-    run(["gdal", "vector", "convert", output_gpq, output_gdb, "--quiet"], check=False)
-    make_archive(str(output_gdb), "zip", output_gdb)
-    rmtree(output_gdb)
-    zip_size = output_gdb_zip.stat().st_size
-    if zip_size > HDX_MAX_SIZE:
-        output_gdb_zip.unlink()
-        split_into_parts(output_dir, iso3, zip_size)
+    if stage is None:
+        if not _extract(provider, iso3, output_dir, output_gpq, partition_dir):
+            return
+        record_stage(provider, iso3, fingerprint, EXTRACTED)
+        stage = EXTRACTED
+    if stage == EXTRACTED:
+        _remove_outputs(output_dir, keep=output_gpq)
+        num_parts = estimate_num_parts(output_gpq, output_dir)
+        if num_parts in (None, 1):
+            parquet_to_gdb(output_gpq, output_gdb)
+            record_stage(provider, iso3, fingerprint, CONVERTED)
+            stage = CONVERTED
+        else:
+            split_into_parts(output_dir, iso3, num_parts)
+    if stage == CONVERTED:
+        output_gdb_zip = output_gdb.with_suffix(".gdb.zip")
+        if output_gdb.exists():
+            output_gdb_zip = zip_gdb(output_gdb)
+        num_parts = ceil(output_gdb_zip.stat().st_size / HDX_MAX_SIZE)
+        if num_parts > 1:
+            split_into_parts(output_dir, iso3, num_parts)
+            remove_gdb_zip(output_gdb_zip)
     output_gpq.unlink(missing_ok=True)
+    record_stage(provider, iso3, fingerprint, ZIPPED)
+
+
+def resume_stage(
+    provider: str, iso3: str, output_dir: Path, fingerprint: str
+) -> str | None:
+    """Return the stage a country resumes after, or None if its files are gone."""
+    output_gpq, output_gdb = _output_paths(iso3, output_dir)
+    stage = journal_stage(provider, iso3, fingerprint)
+    if stage and not _stage_outputs_exist(stage, output_dir, output_gpq, output_gdb):
+        logger.warning("Files of stage %s of %s are gone, restarting", stage, iso3)
+        return None
+    return stage
+
+
+def group_country(
+    provider: str,
+    iso3: str,
+    output_dir: Path,
+    partition_dir: Path | None,
+    fingerprint: str,
+) -> None:
+    """Group a country as group does, logging its memory and spill."""
+    with report_usage(f"Grouping {provider} {iso3}"):
+        group(provider, iso3, output_dir, partition_dir, fingerprint)
+
+
+def init_worker() -> None:
+    """Set up a grouping worker process, which starts without the parent's logging.
+
+    Logs go to the console only, errors reach the parent's log with the
+    result of the country. Its DuckDB session gets a share of the machine.
+    """
+    setup_logging()
+    use_worker_share()
+
+
+def _extract(
+    provider: str,
+    iso3: str,
+    output_dir: Path,
+    output_gpq: Path,
+    partition_dir: Path | None,
+) -> bool:
+    """Write a country's buildings to output_gpq in a fresh output_dir.
+
+    Returns False when no buildings were found for the country.
+    """
+    rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir(exist_ok=True, parents=True)
+    if partition_dir:
+        return read_partition(partition_dir, iso3, output_gpq)
+    return extract_country_buildings(
+        iso3,
+        SOURCE_PARQUET.format(provider=provider),
+        output_gpq,
+        manifest_path(provider),
+    )
+
+
+def _output_paths(iso3: str, output_dir: Path) -> tuple[Path, Path]:
+    """Return the paths of a country's extracted parquet and its GDB."""
+    output_name = f"{iso3.lower()}_buildings"
+    return output_dir / f"{output_name}.parquet", output_dir / f"{output_name}.gdb"
+
+
+def _stage_outputs_exist(
+    stage: str, output_dir: Path, output_gpq: Path, output_gdb: Path
+) -> bool:
+    """Check that the files a stage left for the next one are still there."""
+    if stage == EXTRACTED:
+        return output_gpq.exists()
+    if stage == CONVERTED:
+        return output_gdb.exists() or output_gdb.with_suffix(".gdb.zip").exists()
+    if stage == ZIPPED:
+        return any(output_dir.glob("*.gdb.zip"))
+    return True
+
+
+def _remove_outputs(output_dir: Path, keep: Path) -> None:
+    """Remove what an interrupted stage left in output_dir, except keep."""
+    for path in output_dir.iterdir():
+        if path == keep:
+            continue
+        if path.is_dir():
+            rmtree(path)
+        else:
+            path.unlink()
@@ -0,0 +1,40 @@
+from contextlib import closing
+
+from .state import open_state
+
+EXTRACTED = "extracted"
+CONVERTED = "converted"
+ZIPPED = "zipped"
+PUBLISHED = "published"
+
+
+def journal_stage(provider: str, iso3: str, fingerprint: str) -> str | None:
+    """Return the last stage a country completed from the same inputs.
+
+    A stage reached from other inputs, or none at all, returns None so the
+    country starts again from scratch.
+    """
+    with closing(open_state()) as con:
+        row = con.execute(
+            "SELECT fingerprint, stage FROM journal WHERE provider = ? AND iso3 = ?",
+            (provider, iso3),
+        ).fetchone()
+    if row is None or row["fingerprint"] != fingerprint:
+        return None
+    return row["stage"]
+
+
+def record_stage(provider: str, iso3: str, fingerprint: str, stage: str) -> None:
+    """Record that a country completed a stage from the given inputs."""
+    with closing(open_state()) as con, con:
+        con.execute(
+            """
+            INSERT INTO journal (provider, iso3, fingerprint, stage)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (provider, iso3) DO UPDATE SET
+                fingerprint = excluded.fingerprint,
+                stage = excluded.stage,
+                updated = CURRENT_TIMESTAMP
+            """,
+            (provider, iso3, fingerprint, stage),
+        )
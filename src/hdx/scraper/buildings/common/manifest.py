@@ -0,0 +1,143 @@
+import logging
+from pathlib import Path
+
+from duckdb import DuckDBPyConnection
+from pandas import DataFrame
+
+from .config import (
+    AWS_ENDPOINT_S3,
+    PROVIDER_GOOGLE,
+    PROVIDER_MICROSOFT,
+    SOURCE_PARQUET,
+    data_dir,
+)
+from .engine import engine
+from .s3 import list_objects, s3_prefix
+
+logger = logging.getLogger(__name__)
+
+
+def manifest_path(provider: str) -> Path:
+    """Return the local path of the source file manifest for a provider."""
+    return data_dir / provider / "manifest.parquet"
+
+
+def build_manifest(provider: str) -> Path:
+    """Index every source parquet file by its footer statistics.
+
+    Records path, row count, byte size, ETag and the min/max of the bbox
+    covering column for each file, without reading any row data.
+    """
+    input_path = SOURCE_PARQUET.format(provider=provider)
+    output_path = manifest_path(provider)
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    prefix = f"s3://{AWS_ENDPOINT_S3}/{s3_prefix(provider)}"
+    inventory = list_objects(provider)
+    objects = DataFrame(
+        {
+            "path": [prefix + key for key in inventory],
+            "size": [x.size for x in inventory.values()],
+            "etag": [x.etag for x in inventory.values()],
+        }
+    )
+    with engine() as con:
+        con.register("objects", objects)
+        con.sql(f"""
+            COPY (
+                WITH stats AS (
+                    SELECT
+                        file_name AS path,
+                        sum(row_group_num_rows) FILTER (
+                            WHERE path_in_schema = 'geometry_bbox, xmin'
+                        )::BIGINT AS num_rows,
+                        min(stats_min_value::DOUBLE) FILTER (
+                            WHERE path_in_schema = 'geometry_bbox, xmin'
+                        ) AS xmin,
+                        min(stats_min_value::DOUBLE) FILTER (
+                            WHERE path_in_schema = 'geometry_bbox, ymin'
+                        ) AS ymin,
+                        max(stats_max_value::DOUBLE) FILTER (
+                            WHERE path_in_schema = 'geometry_bbox, xmax'
+                        ) AS xmax,
+                        max(stats_max_value::DOUBLE) FILTER (
+                            WHERE path_in_schema = 'geometry_bbox, ymax'
+                        ) AS ymax
+                    FROM parquet_metadata('{input_path}')
+                    GROUP BY file_name
+                )
+                SELECT path, num_rows, size, etag, xmin, ymin, xmax, ymax
+                FROM stats
+                JOIN objects USING (path)
+                ORDER BY path
+            )
+            TO '{output_path}'
+            WITH (COMPRESSION zstd);
+        """)
+    logger.info("Indexed %s into %s", input_path, output_path)
+    return output_path
+
+
+def overlapping_files(
+    con: DuckDBPyConnection,
+    manifest: Path,
+    bbox: tuple[float, float, float, float],
+) -> list[str]:
+    """Return the source files whose extent overlaps a bbox."""
+    rows = con.sql(f"""
+        SELECT path FROM '{manifest}'
+        WHERE {_overlaps(bbox)}
+        ORDER BY path
+    """).fetchall()
+    return [row[0] for row in rows]
+
+
+def countries_files(
+    con: DuckDBPyConnection, manifest: Path, iso3s: list[str]
+) -> list[str]:
+    """Return the source files whose extent overlaps any of the countries."""
+    rows = con.sql(f"""
+        SELECT DISTINCT m.path
+        FROM '{manifest}' AS m
+        JOIN adm0 AS a ON
+            m.xmax >= a.xmin AND
+            m.xmin <= a.xmax AND
+            m.ymax >= a.ymin AND
+            m.ymin <= a.ymax
+        WHERE a.iso3 IN (SELECT unnest({iso3s}))
+        ORDER BY m.path
+    """).fetchall()
+    return [row[0] for row in rows]
+
+
+def overlapping_bytes(
+    con: DuckDBPyConnection,
+    manifest: Path,
+    bbox: tuple[float, float, float, float],
+) -> int:
+    """Return the total size of the source files whose extent overlaps a bbox."""
+    row = con.sql(f"""
+        SELECT coalesce(sum(size), 0) FROM '{manifest}'
+        WHERE {_overlaps(bbox)}
+    """).fetchone()
+    return int(row[0]) if row else 0
+
+
+def source_list(files: list[str]) -> str:
+    """Return a list of source files as a read_parquet argument."""
+    return "[" + ",".join(f"'{x}'" for x in files) + "]"
+
+
+def _overlaps(bbox: tuple[float, float, float, float]) -> str:
+    """Return a filter for manifest rows whose extent overlaps a bbox."""
+    xmin, ymin, xmax, ymax = bbox
+    return f"""
+        xmax >= {xmin} AND
+        xmin <= {xmax} AND
+        ymax >= {ymin} AND
+        ymin <= {ymax}
+    """
+
+
+if __name__ == "__main__":
+    for provider in (PROVIDER_GOOGLE, PROVIDER_MICROSOFT):
+        build_manifest(provider)
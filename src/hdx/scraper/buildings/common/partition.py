@@ -0,0 +1,61 @@
+import logging
+from pathlib import Path
+from shutil import rmtree
+
+from .engine import engine, load_adm0
+from .extract import intersecting_buildings
+from .manifest import countries_files, source_list
+
+logger = logging.getLogger(__name__)
+
+
+def partition_buildings(
+    input_path: str, output_dir: Path, iso3s: list[str], manifest: Path | None = None
+) -> None:
+    """Split the global buildings into one Hive partition per country.
+
+    Reads the source parquet set once and joins every building against the
+    country polygons, writing output_dir/iso3=XXX/ for each country matched.
+    When a manifest is given, only the files it lists as overlapping one of
+    the countries are read instead of the whole input_path glob.
+    """
+    rmtree(output_dir, ignore_errors=True)
+    output_dir.parent.mkdir(exist_ok=True, parents=True)
+    with engine() as con:
+        load_adm0(con)
+        source = f"'{input_path}'"
+        if manifest and manifest.exists():
+            files = countries_files(con, manifest, iso3s)
+            if not files:
+                logger.info("No source files overlap the countries to partition")
+                return
+            source = source_list(files)
+        con.sql(f"""
+            COPY ({intersecting_buildings(source, iso3s)})
+            TO '{output_dir}'
+            (FORMAT parquet, COMPRESSION zstd, PARTITION_BY (iso3));
+        """)
+    logger.info("Partitioned %s into %s", input_path, output_dir)
+
+
+def read_partition(partition_dir: Path, iso3: str, output_gpq: Path) -> bool:
+    """Move a country out of the partitioned layout into a single parquet.
+
+    Returns False if the partition run found no buildings for the country.
+    """
+    country_dir = partition_dir / f"iso3={iso3}"
+    if not country_dir.exists():
+        return False
+    with engine() as con:
+        con.sql(f"""
+            COPY (
+                SELECT *
+                FROM read_parquet(
+                    '{country_dir}/*.parquet', hive_partitioning = false
+                )
+            )
+            TO '{output_gpq}'
+            WITH (COMPRESSION zstd);
+        """)
+    rmtree(country_dir)
+    return True
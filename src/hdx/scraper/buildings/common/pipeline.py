@@ -0,0 +1,129 @@
+import logging
+from asyncio import Condition, Queue, QueueShutDown, TaskGroup
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import Any, NamedTuple
+
+from .config import ADAPT_GAIN, ADAPT_INTERVAL, STAGE_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimit:
+    """Concurrency limit that follows the throughput and errors of a stage.
+
+    Every ADAPT_INTERVAL seconds the bytes transferred are compared with the
+    previous interval: the limit goes up by one while throughput improves by
+    more than ADAPT_GAIN and down by one when it falls by as much. An error
+    halves the limit and starts a new interval.
+    """
+
+    def __init__(self, name: str, maximum: int) -> None:
+        """Start halfway to the maximum number of tasks at once."""
+        self.name = name
+        self.maximum = max(1, maximum)
+        self.limit = max(1, self.maximum // 2)
+        self._active = 0
+        self._changed = Condition()
+        self._rate = 0.0
+        self._window_start = monotonic()
+        self._window_bytes = 0
+        self._window_errors = 0
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """Wait for a free slot and hold it, recording whether the task fails."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+        try:
+            yield
+        except Exception:
+            self._window_errors += 1
+            raise
+        finally:
+            self._adjust()
+            async with self._changed:
+                self._active -= 1
+                self._changed.notify_all()
+
+    def record(self, nbytes: int) -> None:
+        """Count bytes transferred by a task holding a slot."""
+        self._window_bytes += nbytes
+
+    def _adjust(self) -> None:
+        """Move the limit once an interval has passed, or after an error."""
+        elapsed = max(monotonic() - self._window_start, 1e-6)
+        if self._window_errors:
+            limit, rate = self.limit // 2, 0.0
+        elif elapsed < ADAPT_INTERVAL:
+            return
+        else:
+            rate = self._window_bytes / elapsed
+            limit = self.limit
+            if rate > self._rate * (1 + ADAPT_GAIN):
+                limit += 1
+            elif rate < self._rate * (1 - ADAPT_GAIN):
+                limit -= 1
+        limit = min(max(limit, 1), self.maximum)
+        if limit != self.limit:
+            logger.info(
+                "%s limit %d -> %d after %d errors at %.1f MB/s",
+                self.name,
+                self.limit,
+                limit,
+                self._window_errors,
+                self._window_bytes / elapsed / 1024 / 1024,
+            )
+            self.limit = limit
+        self._rate = rate
+        self._window_start = monotonic()
+        self._window_bytes = 0
+        self._window_errors = 0
+
+
+class Stage(NamedTuple):
+    """A step of a pipeline, run by its own pool of workers."""
+
+    name: str
+    run: Callable[[Any], Awaitable[Any]]
+    workers: int
+
+
+async def run_stages(items: Iterable, stages: list[Stage]) -> None:
+    """Pass each item through the stages in order.
+
+    Stages are linked by queues of STAGE_QUEUE_SIZE, so a slow stage holds
+    back the ones before it rather than letting their files pile up on
+    disk. A stage returns the item for the next one, or None to drop it.
+    """
+    queues = [Queue(STAGE_QUEUE_SIZE) for _ in stages]
+    async with TaskGroup() as tg:
+        workers = [
+            [
+                tg.create_task(_work(stage, queue_in, queue_out), name=stage.name)
+                for _ in range(max(1, stage.workers))
+            ]
+            for stage, queue_in, queue_out in zip(
+                stages, queues, [*queues[1:], None], strict=True
+            )
+        ]
+        for item in items:
+            await queues[0].put(item)
+        for queue, stage_workers in zip(queues, workers, strict=True):
+            queue.shutdown()
+            for worker in stage_workers:
+                await worker
+
+
+async def _work(stage: Stage, queue_in: Queue, queue_out: Queue | None) -> None:
+    """Run a stage on items from its queue until the queue is shut down."""
+    while True:
+        try:
+            item = await queue_in.get()
+        except QueueShutDown:
+            return
+        item = await stage.run(item)
+        if item is not None and queue_out is not None:
+            await queue_out.put(item)
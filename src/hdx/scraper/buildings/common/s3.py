@@ -0,0 +1,221 @@
+import logging
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from functools import cache
+from hashlib import md5
+from math import ceil
+from pathlib import Path
+from typing import NamedTuple
+
+import boto3
+from botocore.client import BaseClient
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from .config import (
+    AWS_ENDPOINT_S3,
+    AWS_REGION,
+    S3_VARIANTS,
+    UPLOAD_INFLIGHT_MB,
+    UPLOAD_LIMIT,
+    UPLOAD_PART_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Each worker holds at most one part in memory, capping bytes in flight
+_UPLOAD_WORKERS = max(1, UPLOAD_INFLIGHT_MB * 1024 * 1024 // UPLOAD_PART_SIZE)
+
+
+class S3Object(NamedTuple):
+    """Size and ETag of an object in the inventory."""
+
+    size: int
+    etag: str
+
+
+@cache
+def _upload_pool() -> ThreadPoolExecutor:
+    """Return the pool every upload sends its parts through."""
+    return ThreadPoolExecutor(_UPLOAD_WORKERS, thread_name_prefix="upload")
+
+
+@cache
+def s3_client() -> BaseClient:
+    """Return the S3 client shared by every task, with its connection pool.
+
+    Endpoint and credentials come from the usual AWS environment variables,
+    so setting AWS_ENDPOINT_URL points it at a local S3 stand-in.
+    """
+    config = Config(max_pool_connections=_UPLOAD_WORKERS + UPLOAD_LIMIT)
+    return boto3.client("s3", region_name=AWS_REGION, config=config)
+
+
+def s3_prefix(provider: str) -> str:
+    """Return the key prefix under which a provider's files are published."""
+    return f"hdx/{provider}-open-buildings/"
+
+
+def list_objects(provider: str) -> dict[str, S3Object]:
+    """List every published variant of a provider into an in-memory index.
+
+    Each variant subfolder is read with one paginated listing. Keys are
+    relative to the provider prefix, e.g. "parquet/{name}".
+    """
+    prefix = s3_prefix(provider)
+    paginator = s3_client().get_paginator("list_objects_v2")
+    inventory = {}
+    for subfolder in S3_VARIANTS:
+        pages = paginator.paginate(
+            Bucket=AWS_ENDPOINT_S3, Prefix=f"{prefix}{subfolder}/"
+        )
+        for page in pages:
+            for obj in page.get("Contents", []):
+                inventory[obj["Key"].removeprefix(prefix)] = S3Object(
+                    obj["Size"], obj["ETag"].strip('"')
+                )
+    logger.info("Found %d objects under %s", len(inventory), prefix)
+    return inventory
+
+
+def is_published(inventory: dict[str, S3Object], name: str) -> bool:
+    """Check whether all variants of a file are in the inventory."""
+    return all(f"{subfolder}/{name}" in inventory for subfolder in S3_VARIANTS)
+
+
+def upload_file(input_path: Path, key: str) -> None:
+    """Upload a file to the bucket, in parallel parts when it is large.
+
+    Parts from every upload share one pool, so at most UPLOAD_INFLIGHT_MB
+    is read into memory at a time. Each part carries its Content-MD5 for
+    the server to verify. An incomplete multipart upload of the same key
+    is resumed, skipping parts whose MD5 already matches, and one the server
+    will not complete is aborted so that the next attempt starts afresh.
+    """
+    size = input_path.stat().st_size
+    if size <= UPLOAD_PART_SIZE:
+        _upload_pool().submit(_put_object, input_path, key).result()
+        return
+    client = s3_client()
+    upload_id, uploaded = _resume_upload(key)
+    futures = [
+        _upload_pool().submit(
+            _upload_part, input_path, key, upload_id, part_number, uploaded
+        )
+        for part_number in range(1, ceil(size / UPLOAD_PART_SIZE) + 1)
+    ]
+    try:
+        parts = [future.result() for future in futures]
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+    try:
+        client.complete_multipart_upload(
+            Bucket=AWS_ENDPOINT_S3,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except ClientError:
+        _abort_upload(key, upload_id)
+        raise
+
+
+def abort_uploads(key: str) -> None:
+    """Abort every incomplete multipart upload of a key, which S3 bills for."""
+    for upload in _incomplete_uploads(key):
+        _abort_upload(key, upload["UploadId"])
+
+
+def _put_object(input_path: Path, key: str) -> None:
+    """Upload a file in a single request."""
+    data = input_path.read_bytes()
+    s3_client().put_object(
+        Bucket=AWS_ENDPOINT_S3, Key=key, Body=data, ContentMD5=_content_md5(data)
+    )
+
+
+def _resume_upload(key: str) -> tuple[str, dict[int, str]]:
+    """Return the latest incomplete upload of a key with its parts' ETags.
+
+    Older incomplete uploads of the key are aborted. Starts a new multipart
+    upload when there is none to resume, or its parts cannot be listed.
+    """
+    client = s3_client()
+    uploads = sorted(_incomplete_uploads(key), key=lambda x: x["Initiated"])
+    for upload in uploads[:-1]:
+        _abort_upload(key, upload["UploadId"])
+    if uploads:
+        upload_id = uploads[-1]["UploadId"]
+        try:
+            uploaded = _list_parts(key, upload_id)
+        except ClientError:
+            logger.exception("Could not resume upload of %s", key)
+            _abort_upload(key, upload_id)
+        else:
+            logger.info("Resuming upload of %s with %d parts done", key, len(uploaded))
+            return upload_id, uploaded
+    response = client.create_multipart_upload(Bucket=AWS_ENDPOINT_S3, Key=key)
+    return response["UploadId"], {}
+
+
+def _incomplete_uploads(key: str) -> list[dict]:
+    """List the multipart uploads of exactly this key that are not complete."""
+    paginator = s3_client().get_paginator("list_multipart_uploads")
+    return [
+        upload
+        for page in paginator.paginate(Bucket=AWS_ENDPOINT_S3, Prefix=key)
+        for upload in page.get("Uploads", [])
+        if upload["Key"] == key
+    ]
+
+
+def _list_parts(key: str, upload_id: str) -> dict[int, str]:
+    """Return the ETag of each part already uploaded, by part number."""
+    paginator = s3_client().get_paginator("list_parts")
+    uploaded = {}
+    for page in paginator.paginate(Bucket=AWS_ENDPOINT_S3, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            uploaded[part["PartNumber"]] = part["ETag"].strip('"')
+    return uploaded
+
+
+def _abort_upload(key: str, upload_id: str) -> None:
+    """Abort a multipart upload, freeing the parts stored for it."""
+    logger.warning("Aborting upload %s of %s", upload_id, key)
+    with suppress(ClientError):
+        s3_client().abort_multipart_upload(
+            Bucket=AWS_ENDPOINT_S3, Key=key, UploadId=upload_id
+        )
+
+
+def _upload_part(
+    input_path: Path,
+    key: str,
+    upload_id: str,
+    part_number: int,
+    uploaded: dict[int, str],
+) -> dict:
+    """Upload one part of a file, unless the same part is already uploaded."""
+    with input_path.open("rb") as f:
+        f.seek((part_number - 1) * UPLOAD_PART_SIZE)
+        data = f.read(UPLOAD_PART_SIZE)
+    digest = md5(data, usedforsecurity=False)
+    if uploaded.get(part_number) == digest.hexdigest():
+        return {"PartNumber": part_number, "ETag": f'"{digest.hexdigest()}"'}
+    response = s3_client().upload_part(
+        Bucket=AWS_ENDPOINT_S3,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=data,
+        ContentMD5=b64encode(digest.digest()).decode(),
+    )
+    return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+
+def _content_md5(data: bytes) -> str:
+    """Return the base64 MD5 digest S3 checks the body against."""
+    return b64encode(md5(data, usedforsecurity=False).digest()).decode()
@@ -1,44 +1,91 @@
-from math import ceil
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
 from pathlib import Path
-from shutil import make_archive, rmtree
-from subprocess import run
+from shutil import rmtree
 
-from duckdb import connect
+from duckdb import DuckDBPyConnection
 
-from .config import HDX_MAX_SIZE
+from .engine import engine
+from .gdb import parquet_to_gdb_zip
 
 
-def split_into_parts(output_dir: Path, iso3: str, zip_size: int) -> None:
-    """Split the country GDB into the fewest parts that each fit within HDX_MAX_SIZE."""
+def split_into_parts(output_dir: Path, iso3: str, num_parts: int) -> None:
+    """Split the country GDB into num_parts that each fit within HDX_MAX_SIZE.
+
+    Buildings are ordered along a Hilbert curve over the country extent and
+    cut into equal ranges in one pass, so each part covers a compact region.
+    The parts are then converted to GDB concurrently. Parts left over from
+    an interrupted split are removed first.
+    """
     input_path = output_dir / f"{iso3.lower()}_buildings.parquet"
-    num_parts = ceil(zip_size / HDX_MAX_SIZE)
-
-    with connect() as con:
-        row = con.sql(f"SELECT COUNT(*) FROM '{input_path}'").fetchone()
-        total_rows = row[0] if row else 0
-
-    rows_per_part = ceil(total_rows / num_parts)
-
-    for part_num in range(1, num_parts + 1):
-        offset = (part_num - 1) * rows_per_part
-        output_name = f"{iso3.lower()}_buildings_part{part_num}"
-        output_gpq = output_dir / f"{output_name}.parquet"
-        output_gdb = output_dir / f"{output_name}.gdb"
-
-        with connect() as con:
-            con.sql("INSTALL spatial; LOAD spatial;")
-            con.sql(f"""
-                COPY (
-                    SELECT * FROM '{input_path}'
-                    LIMIT {rows_per_part} OFFSET {offset}
-                )
-                TO '{output_gpq}'
-                WITH (COMPRESSION zstd);
-            """)
-        run(
-            ["gdal", "vector", "convert", output_gpq, output_gdb, "--quiet"],
-            check=False,
-        )
-        make_archive(str(output_gdb), "zip", output_gdb)
-        rmtree(output_gdb)
-        output_gpq.unlink()
+    parts_dir = output_dir / "parts"
+    rmtree(parts_dir, ignore_errors=True)
+    for path in output_dir.glob(f"{iso3.lower()}_buildings_part*"):
+        if path.is_dir():
+            rmtree(path)
+        else:
+            path.unlink()
+
+    with engine() as con:
+        xmin, ymin, xmax, ymax = con.sql(f"""
+            SELECT min(bbox.xmin), min(bbox.ymin), max(bbox.xmax), max(bbox.ymax)
+            FROM '{input_path}'
+        """).fetchone()  # type: ignore  # noqa: PGH003
+        con.sql(f"""
+            COPY (
+                SELECT
+                    *,
+                    ntile({num_parts}) OVER (
+                        ORDER BY ST_Hilbert(
+                            (bbox.xmin + bbox.xmax) / 2,
+                            (bbox.ymin + bbox.ymax) / 2,
+                            {{
+                                'min_x': {xmin},
+                                'min_y': {ymin},
+                                'max_x': {xmax},
+                                'max_y': {ymax}
+                            }}::BOX_2D
+                        )
+                    ) AS part
+                FROM '{input_path}'
+            )
+            TO '{parts_dir}'
+            (FORMAT parquet, COMPRESSION zstd, PARTITION_BY (part));
+        """)
+
+        output_gpqs = []
+        for part_num in range(1, num_parts + 1):
+            output_gpq = output_dir / f"{iso3.lower()}_buildings_part{part_num}.parquet"
+            if _collect_part(con, parts_dir / f"part={part_num}", output_gpq):
+                output_gpqs.append(output_gpq)
+    rmtree(parts_dir)
+
+    with ThreadPoolExecutor(min(num_parts, cpu_count())) as pool:
+        list(pool.map(_convert_part, output_gpqs))
+
+
+def _collect_part(con: DuckDBPyConnection, part_dir: Path, output_gpq: Path) -> bool:
+    """Gather the files DuckDB wrote for a partition into output_gpq.
+
+    A partition can be written as several files, by thread or as it is
+    flushed, and is absent when it got no rows. Returns False if it is empty.
+    """
+    paths = sorted(part_dir.glob("*.parquet"))
+    if len(paths) == 1:
+        paths[0].rename(output_gpq)
+    elif paths:
+        con.sql(f"""
+            COPY (
+                SELECT *
+                FROM read_parquet('{part_dir}/*.parquet', hive_partitioning = false)
+            )
+            TO '{output_gpq}'
+            (FORMAT parquet, COMPRESSION zstd);
+        """)
+    return bool(paths)
+
+
+def _convert_part(output_gpq: Path) -> None:
+    """Convert one part parquet to a zipped GDB and remove the parquet."""
+    parquet_to_gdb_zip(output_gpq, output_gpq.with_suffix(".gdb"))
+    output_gpq.unlink()
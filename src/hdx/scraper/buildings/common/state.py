@@ -0,0 +1,137 @@
+import json
+import logging
+import sqlite3
+
+from httpx import AsyncClient, Headers, codes
+from tenacity import retry, stop_after_attempt, wait_fixed
+
+from .config import ATTEMPT, STATE_DB, WAIT
+
+logger = logging.getLogger(__name__)
+
+
+def open_state() -> sqlite3.Connection:
+    """Open the store of what has already been published.
+
+    Holds the version of each source tile uploaded to S3, the source files
+    and boundary each country was last published from, and the journal of
+    the stage each country reached in the current grouping run.
+    """
+    con = sqlite3.connect(STATE_DB)
+    con.row_factory = sqlite3.Row
+    con.executescript("""
+        CREATE TABLE IF NOT EXISTS tiles (
+            url TEXT PRIMARY KEY,
+            provider TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            content_length INTEGER,
+            output_keys TEXT NOT NULL,
+            updated TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS countries (
+            provider TEXT NOT NULL,
+            iso3 TEXT NOT NULL,
+            adm0_hash TEXT NOT NULL,
+            updated TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (provider, iso3)
+        );
+        CREATE TABLE IF NOT EXISTS country_inputs (
+            provider TEXT NOT NULL,
+            iso3 TEXT NOT NULL,
+            path TEXT NOT NULL,
+            etag TEXT,
+            PRIMARY KEY (provider, iso3, path)
+        );
+        CREATE TABLE IF NOT EXISTS journal (
+            provider TEXT NOT NULL,
+            iso3 TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            updated TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (provider, iso3)
+        );
+    """)
+    return con
+
+
+def record_tile(
+    con: sqlite3.Connection,
+    provider: str,
+    url: str,
+    headers: Headers,
+    output_keys: list[str],
+) -> None:
+    """Record the version of a tile and the keys it was published to."""
+    content_length = headers.get("Content-Length")
+    with con:
+        con.execute(
+            """
+            INSERT INTO tiles (
+                url, provider, etag, last_modified, content_length, output_keys
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                content_length = excluded.content_length,
+                output_keys = excluded.output_keys,
+                updated = CURRENT_TIMESTAMP
+            """,
+            (
+                url,
+                provider,
+                headers.get("ETag"),
+                headers.get("Last-Modified"),
+                int(content_length) if content_length else None,
+                json.dumps(output_keys),
+            ),
+        )
+
+
+@retry(stop=stop_after_attempt(ATTEMPT), wait=wait_fixed(WAIT))
+async def check_tile(  # noqa: PLR0913
+    client: AsyncClient,
+    con: sqlite3.Connection,
+    provider: str,
+    url: str,
+    output_keys: list[str],
+    *,
+    published: bool,
+) -> Headers | None:
+    """Return the headers of a tile that is new or changed, or None to skip it.
+
+    A conditional HEAD request with the recorded ETag and Last-Modified
+    tells whether the source changed. A tile that is published but has no
+    record yet, from before versions were kept, is recorded as it is now.
+    """
+    row = con.execute("SELECT * FROM tiles WHERE url = ?", (url,)).fetchone()
+    conditions = {}
+    if row and published:
+        if row["etag"]:
+            conditions["If-None-Match"] = row["etag"]
+        if row["last_modified"]:
+            conditions["If-Modified-Since"] = row["last_modified"]
+    r = await client.head(url, headers=conditions)
+    if r.status_code == codes.NOT_MODIFIED:
+        return None
+    r.raise_for_status()
+    if not published:
+        return r.headers
+    if row is None:
+        record_tile(con, provider, url, r.headers, output_keys)
+        return None
+    if _same_version(row, r.headers):
+        return None
+    logger.info("Source changed for %s", url)
+    return r.headers
+
+
+def _same_version(row: sqlite3.Row, headers: Headers) -> bool:
+    """Compare a recorded tile with its current headers."""
+    content_length = headers.get("Content-Length")
+    if content_length and row["content_length"] != int(content_length):
+        return False
+    if row["etag"] and headers.get("ETag"):
+        return row["etag"] == headers["ETag"]
+    return row["last_modified"] == headers.get("Last-Modified")
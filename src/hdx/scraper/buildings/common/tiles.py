@@ -0,0 +1,194 @@
+from asyncio import Task, TaskGroup, create_task, to_thread
+from collections.abc import Awaitable, Callable
+from contextlib import closing
+from functools import partial
+from pathlib import Path
+from sqlite3 import Connection
+from typing import NamedTuple
+
+from httpx import AsyncClient, Headers
+
+from .budget import DiskBudget, tile_scratch
+from .config import (
+    CONVERT_LIMIT,
+    DECOMPRESS_LIMIT,
+    DOWNLOAD_LIMIT,
+    S3_VARIANTS,
+    STREAM_INGEST,
+    TIMEOUT,
+    UPLOAD_LIMIT,
+)
+from .download import decompress_gz, download_gz, upload_to_s3
+from .pipeline import AdaptiveLimit, Stage, run_stages
+from .s3 import S3Object, is_published, list_objects, s3_prefix
+from .state import check_tile, open_state, record_tile
+from .variants import write_variants
+
+
+class Tile(NamedTuple):
+    """A source tile and the files it goes through on its way to S3."""
+
+    url: str
+    output_dir: Path
+    s3_key: str  # relative to each variant subfolder
+    raw_path: Path  # decompressed source
+    headers: Headers | None = None
+    sorted_upload: Task | None = None  # started once the sorted file is written
+
+    @property
+    def gz_path(self) -> Path:
+        """Return the path the compressed source is downloaded to."""
+        return self.raw_path.with_suffix(self.raw_path.suffix + ".gz")
+
+    @property
+    def sorted_path(self) -> Path:
+        """Return the path of the bbox sorted GeoParquet 2.0 conversion."""
+        return self.output_dir / self.s3_key.replace(".parquet", ".sorted.parquet")
+
+    def variant_path(self, subfolder: str) -> Path:
+        """Return the local path of the file uploaded to a variant subfolder."""
+        if subfolder == S3_VARIANTS[0]:
+            return self.sorted_path
+        return self.output_dir / subfolder / self.s3_key
+
+
+async def process_tiles(
+    provider: str,
+    tiles: list[Tile],
+    convert: Callable[[Tile], Awaitable[None]],
+) -> None:
+    """Download, convert and upload the tiles that are new or changed.
+
+    Each stage has its own workers: downloads and uploads adapt their
+    number to throughput and errors, up to DOWNLOAD_LIMIT and UPLOAD_LIMIT,
+    while decompression and conversion get DECOMPRESS_LIMIT and
+    CONVERT_LIMIT. convert writes the sorted GeoParquet of a tile, from its
+    raw file, or from the URL when STREAM_INGEST skips the first stages.
+    Tiles are only admitted past the check while their projected scratch
+    space fits the disk budget.
+    """
+    inventory = await to_thread(list_objects, provider)
+    budget = DiskBudget(f"Tiles {provider}")
+    download_limit = AdaptiveLimit("Download", DOWNLOAD_LIMIT)
+    upload_limit = AdaptiveLimit("Upload", UPLOAD_LIMIT)
+    with closing(open_state()) as state:
+        async with AsyncClient(timeout=TIMEOUT) as client:
+            check = partial(_check, client, state, provider, inventory)
+            download = partial(_download, client, download_limit)
+            upload_variant = partial(_upload_variant, provider, upload_limit)
+            convert_tile = partial(_convert, convert, upload_variant)
+            upload = partial(_upload, state, provider, upload_variant, budget)
+            stages = [
+                Stage("check", check, DOWNLOAD_LIMIT),
+                Stage("admit", partial(_admit, budget), 1),
+            ]
+            if not STREAM_INGEST:
+                stages += [
+                    Stage("download", download, DOWNLOAD_LIMIT),
+                    Stage("decompress", _decompress, DECOMPRESS_LIMIT),
+                ]
+            stages += [
+                Stage("convert", convert_tile, CONVERT_LIMIT),
+                Stage("upload", upload, UPLOAD_LIMIT),
+            ]
+            await run_stages(tiles, stages)
+    budget.report()
+
+
+def _output_keys(provider: str, tile: Tile) -> list[str]:
+    """Return the S3 keys of every variant of a tile."""
+    return [f"{s3_prefix(provider)}{x}/{tile.s3_key}" for x in S3_VARIANTS]
+
+
+async def _check(
+    client: AsyncClient,
+    state: Connection,
+    provider: str,
+    inventory: dict[str, S3Object],
+    tile: Tile,
+) -> Tile | None:
+    """Keep a tile only when it is new or changed at the source."""
+    headers = await check_tile(
+        client,
+        state,
+        provider,
+        tile.url,
+        _output_keys(provider, tile),
+        published=is_published(inventory, tile.s3_key),
+    )
+    return tile._replace(headers=headers) if headers is not None else None
+
+
+async def _admit(budget: DiskBudget, tile: Tile) -> Tile:
+    """Wait until the scratch space of a tile fits the disk budget.
+
+    A single worker admits tiles in order, so a big tile is not overtaken
+    forever by smaller ones.
+    """
+    size = tile.headers.get("Content-Length") if tile.headers else None
+    scratch = tile_scratch(int(size) if size else None, stream=STREAM_INGEST)
+    await budget.reserve_async(tile.url, scratch)
+    return tile
+
+
+async def _download(client: AsyncClient, limit: AdaptiveLimit, tile: Tile) -> Tile:
+    """Download the compressed source of a tile."""
+    await download_gz(client, tile.url, tile.gz_path, limit)
+    return tile
+
+
+async def _decompress(tile: Tile) -> Tile:
+    """Decompress the source of a tile."""
+    await to_thread(decompress_gz, tile.gz_path, tile.raw_path)
+    return tile
+
+
+async def _convert(
+    convert: Callable[[Tile], Awaitable[None]],
+    upload_variant: Callable[[Tile, str], Awaitable[None]],
+    tile: Tile,
+) -> Tile:
+    """Convert a tile from raw with SORT_BY_BBOX once, then write its variants.
+
+    The sorted file starts uploading as soon as it is written, while the
+    other variants are written from it rather than from the raw source.
+    """
+    await convert(tile)
+    tile.raw_path.unlink(missing_ok=True)
+    sorted_upload = create_task(upload_variant(tile, S3_VARIANTS[0]))
+    try:
+        await to_thread(
+            write_variants,
+            tile.sorted_path,
+            *(tile.variant_path(x) for x in S3_VARIANTS[1:]),
+        )
+    except BaseException:
+        sorted_upload.cancel()
+        raise
+    return tile._replace(sorted_upload=sorted_upload)
+
+
+async def _upload(
+    state: Connection,
+    provider: str,
+    upload_variant: Callable[[Tile, str], Awaitable[None]],
+    budget: DiskBudget,
+    tile: Tile,
+) -> None:
+    """Upload the other variants of a tile at once, then record its version."""
+    async with TaskGroup() as tg:
+        for subfolder in S3_VARIANTS[1:]:
+            tg.create_task(upload_variant(tile, subfolder))
+        await (tile.sorted_upload or upload_variant(tile, S3_VARIANTS[0]))
+    for subfolder in S3_VARIANTS:
+        tile.variant_path(subfolder).unlink()
+    budget.release(tile.url)
+    record_tile(state, provider, tile.url, tile.headers, _output_keys(provider, tile))
+
+
+async def _upload_variant(
+    provider: str, limit: AdaptiveLimit, tile: Tile, subfolder: str
+) -> None:
+    """Upload one variant of a tile."""
+    key = f"{s3_prefix(provider)}{subfolder}/{tile.s3_key}"
+    await upload_to_s3(tile.variant_path(subfolder), key, limit)
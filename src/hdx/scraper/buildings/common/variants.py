@@ -0,0 +1,87 @@
+import json
+from contextlib import suppress
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+GEOPARQUET_VERSION = "1.1.0"
+WKB_EXTENSION = "geoarrow.wkb"
+
+
+class _WkbType(pa.ExtensionType):
+    """Minimal geoarrow.wkb type so Parquet GEOMETRY columns round trip.
+
+    Without a registered geoarrow.wkb type, pyarrow reads GEOMETRY columns as
+    plain binary and loses the logical type and CRS on write.
+    """
+
+    def __init__(self, metadata: bytes = b"{}") -> None:
+        """Wrap WKB binary storage with its GeoArrow metadata."""
+        self._metadata = metadata
+        super().__init__(pa.binary(), WKB_EXTENSION)
+
+    def __arrow_ext_serialize__(self) -> bytes:
+        """Return the GeoArrow metadata, including the CRS."""
+        return self._metadata
+
+    @classmethod
+    def __arrow_ext_deserialize__(
+        cls, storage_type: pa.DataType, serialized: bytes
+    ) -> "_WkbType":
+        """Rebuild the type from the metadata stored in the file."""
+        return cls(serialized)
+
+
+with suppress(pa.ArrowKeyError):  # already registered, e.g. by geoarrow-pyarrow
+    pa.register_extension_type(_WkbType())
+
+
+def _geoparquet_schema(schema: pa.Schema) -> pa.Schema:
+    """Return the GeoParquet 1.1 schema: WKB as binary with "geo" metadata."""
+    geo = json.loads(schema.metadata[b"geo"])
+    geo["version"] = GEOPARQUET_VERSION
+    fields = [
+        field.with_type(field.type.storage_type)
+        if isinstance(field.type, pa.ExtensionType)
+        and field.type.extension_name == WKB_EXTENSION
+        else field
+        for field in schema
+    ]
+    metadata = {**schema.metadata, b"geo": json.dumps(geo).encode()}
+    return pa.schema(fields, metadata=metadata)
+
+
+def _parquet_schema(schema: pa.Schema) -> pa.Schema:
+    """Return the plain Parquet schema: GEOMETRY types, no "geo" metadata."""
+    metadata = {k: v for k, v in schema.metadata.items() if k != b"geo"}
+    return schema.with_metadata(metadata)
+
+
+def write_variants(input_path: Path, geoparquet_path: Path, parquet_path: Path) -> None:
+    """Write the GeoParquet 1.1 and Parquet variants of a sorted GeoParquet 2.0.
+
+    Reads each row group of the input once and writes it to both outputs,
+    which only differ in geometry encoding and metadata. Row groups are kept
+    as they are, so the bbox ordering of the input carries over.
+    """
+    source = pq.ParquetFile(input_path, arrow_extensions_enabled=True)
+    schema = source.schema_arrow
+    geoparquet_schema = _geoparquet_schema(schema)
+    parquet_schema = _parquet_schema(schema)
+    geoparquet_path.parent.mkdir(exist_ok=True, parents=True)
+    parquet_path.parent.mkdir(exist_ok=True, parents=True)
+    options = {"compression": "zstd", "compression_level": 15}
+    with (
+        pq.ParquetWriter(geoparquet_path, geoparquet_schema, **options) as geoparquet,
+        pq.ParquetWriter(parquet_path, parquet_schema, **options) as parquet,
+    ):
+        for i in range(source.num_row_groups):
+            table = source.read_row_group(i)
+            geoparquet.write_table(
+                table.cast(geoparquet_schema), row_group_size=table.num_rows
+            )
+            parquet.write_table(
+                table.replace_schema_metadata(parquet_schema.metadata),
+                row_group_size=table.num_rows,
+            )
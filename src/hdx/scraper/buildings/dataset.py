@@ -8,19 +8,47 @@ from hdx.location.country import Country
 from tenacity import retry, stop_after_attempt, wait_fixed
 
 from .common.config import ATTEMPT, WAIT
+from .common.gdb import content_hash
 
 logger = logging.getLogger(__name__)
 
 
+_CONTENT_HASH = "content_sha256"
+
+
 @retry(stop=stop_after_attempt(ATTEMPT), wait=wait_fixed(WAIT))
-def _add_resource(dataset: Dataset, resource_path: Path) -> None:
-    """Add a resource to a dataset."""
+def _published_resources(dataset_name: str) -> dict[str, Resource]:
+    """Return the resources of a dataset as published on HDX, by name."""
+    dataset = Dataset.read_from_hdx(dataset_name)
+    if dataset is None:
+        return {}
+    return {x["name"]: x for x in dataset.get_resources()}
+
+
+def _add_resource(
+    dataset: Dataset, resource_path: Path, published: Resource | None
+) -> None:
+    """Add a resource to a dataset, given its published version if any.
+
+    The hash of the zipped contents is kept on the resource, and when it
+    matches the published one the file is not uploaded again, only the
+    resource metadata is updated.
+    """
     resource_data = {
         "name": resource_path.name,
         "description": "Building footprint data as File Geodatabase.",
     }
     resource = Resource(resource_data)
-    resource.set_file_to_upload(str(resource_path))
+    digest = content_hash(resource_path)
+    if digest and published and published.get(_CONTENT_HASH) == digest:
+        logger.info("Contents unchanged, not uploading %s", resource_path.name)
+        resource["url"] = published["url"]
+        resource["url_type"] = "upload"
+        resource["resource_type"] = "file.upload"
+    else:
+        resource.set_file_to_upload(str(resource_path))
+    if digest:
+        resource[_CONTENT_HASH] = digest
     resource.set_format("Geodatabase")
     dataset.add_update_resource(resource)
 
@@ -40,29 +68,26 @@ def _make_dataset(provider: str, iso3: str, country_name: str) -> Dataset:
 def generate_datasets(
     provider: str, iso3: str, resources: Path, *, metadata_only: bool = False
 ) -> list[Dataset]:
-    """Return one dataset per resource file, each with a single resource."""
+    """Return the dataset of a country, with a resource per part file.
+
+    Parts are resources of the one dataset, so that they are published
+    together in a single update of it.
+    """
     country_name = Country.get_country_name_from_iso3(iso3)
     if not country_name:
         logger.error("Country not found for %s", iso3)
         return []
+    dataset = _make_dataset(provider, iso3, country_name)
+    try:
+        dataset.add_country_location(iso3)
+    except HDXError:
+        logger.exception("Couldn't find country %s, skipping", iso3)
+        return []
     if metadata_only:
-        dataset = _make_dataset(provider, iso3, country_name)
-        try:
-            dataset.add_country_location(iso3)
-        except HDXError:
-            logger.exception("Couldn't find country %s, skipping", iso3)
-            return []
         return [dataset]
-    datasets = []
+    published = _published_resources(dataset["name"])
     for resource_path in sorted(resources.iterdir()):
         if resource_path.suffixes != [".gdb", ".zip"]:
             continue
-        dataset = _make_dataset(provider, iso3, country_name)
-        try:
-            dataset.add_country_location(iso3)
-        except HDXError:
-            logger.exception("Couldn't find country %s, skipping", iso3)
-            continue
-        _add_resource(dataset, resource_path)
-        datasets.append(dataset)
-    return datasets
+        _add_resource(dataset, resource_path, published.get(resource_path.name))
+    return [dataset] if dataset.get_resources() else []
@@ -1,71 +1,48 @@
-from asyncio import Semaphore, TaskGroup, run
+from asyncio import run
 
-from httpx import AsyncClient
 from pandas import read_csv
 
-from ..common.config import CONCURRENCY_LIMIT, PROVIDER_MICROSOFT, TIMEOUT, data_dir
-from ..common.download import (
-    download_gz,
-    s3_file_exists,
-    upload_to_s3,
-    vector_to_geoparquet,
-)
+from ..common.config import PROVIDER_MICROSOFT, STREAM_INGEST, data_dir
+from ..common.download import stream_gz_to_geoparquet, vector_to_geoparquet
+from ..common.manifest import build_manifest
+from ..common.tiles import Tile, process_tiles
 
 DATASET_LINKS = (
     "https://minedbuildings.z5.web.core.windows.net/global-buildings/dataset-links.csv"
 )
 
 
-async def _fetch_url(client: AsyncClient, url: str, semaphor: Semaphore) -> None:
-    """Download a large file from a URL in chunks using httpx."""
-    async with semaphor:
-        output_dir = data_dir / PROVIDER_MICROSOFT / "inputs"
-        file_name = url.rsplit("/global-buildings.geojsonl/", maxsplit=1)[-1]
-        output_path = output_dir / file_name.replace(".csv.gz", ".geojsonl")
-        output_parquet = output_dir / file_name.replace(".csv.gz", ".parquet")
-        s3_key = str(output_parquet.relative_to(output_dir))
-        if await s3_file_exists(PROVIDER_MICROSOFT, "parquet", s3_key):
-            return
-        sorted_parquet = output_dir / file_name.replace(".csv.gz", ".sorted.parquet")
-        await download_gz(client, url, output_path)
-        # Convert from raw with SORT_BY_BBOX once; other variants reuse this sorted file
-        await vector_to_geoparquet(
-            output_path, sorted_parquet, use_parquet_geo_types="YES", sort_by_bbox=True
-        )
-        await upload_to_s3(
-            PROVIDER_MICROSOFT,
-            output_dir,
-            sorted_parquet,
-            "geoparquet-2.0",
-            s3_name=s3_key,
-        )
-        for use_geo_types, subfolder in [
-            (None, "geoparquet-1.1"),
-            ("ONLY", "parquet"),
-        ]:
-            await vector_to_geoparquet(
-                sorted_parquet, output_parquet, use_parquet_geo_types=use_geo_types
-            )
-            await upload_to_s3(
-                PROVIDER_MICROSOFT, output_dir, output_parquet, subfolder
-            )
-            output_parquet.unlink()
-        sorted_parquet.unlink()
-        output_path.unlink()
+def _tile(url: str) -> Tile:
+    """Return where a tile is downloaded and published."""
+    output_dir = data_dir / PROVIDER_MICROSOFT / "inputs"
+    file_name = url.rsplit("/global-buildings.geojsonl/", maxsplit=1)[-1]
+    return Tile(
+        url,
+        output_dir,
+        file_name.replace(".csv.gz", ".parquet"),
+        output_dir / file_name.replace(".csv.gz", ".geojsonl"),
+    )
 
 
-async def _download_files(urls: list[str]) -> None:
-    """Download files asynchronusly."""
-    semaphore = Semaphore(CONCURRENCY_LIMIT)
-    async with AsyncClient(timeout=TIMEOUT) as client, TaskGroup() as tg:
-        [tg.create_task(_fetch_url(client, url, semaphore)) for url in urls]
+async def _convert(tile: Tile) -> None:
+    """Convert a tile's GeoJSONSeq to a bbox sorted GeoParquet."""
+    if STREAM_INGEST:
+        await stream_gz_to_geoparquet(tile.url, tile.sorted_path, "GeoJSONSeq")
+    else:
+        await vector_to_geoparquet(
+            tile.raw_path,
+            tile.sorted_path,
+            use_parquet_geo_types="YES",
+            sort_by_bbox=True,
+        )
 
 
 def main() -> None:
     """Read the master list of building footprint URLs and download them."""
     dataset_links = read_csv(DATASET_LINKS, usecols=["Url"])
-    urls = dataset_links["Url"].to_list()
-    run(_download_files(urls))
+    tiles = [_tile(url) for url in dataset_links["Url"].to_list()]
+    run(process_tiles(PROVIDER_MICROSOFT, tiles, _convert))
+    build_manifest(PROVIDER_MICROSOFT)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+import re
+from pathlib import Path
+from urllib.parse import parse_qs
+
+import pytest
+from httpx import Client, HTTPStatusError, MockTransport, Request, Response
+from tenacity import wait_none
+
+from hdx.scraper.buildings.common.admin0 import (
+    _fetch_if_changed,
+    _fetch_page,
+    _fetch_pages,
+)
+
+_IDS = [400, 3, 11, 7, 10]
+_LAYER = {
+    "fields": [
+        {"name": "OBJECTID", "type": "esriFieldTypeOID"},
+        {"name": "iso3cd", "type": "esriFieldTypeString"},
+    ],
+    "maxRecordCount": 2,
+    "editingInfo": {"lastEditDate": 1700000000000},
+}
+
+
+class _FeatureServer:
+    """Stand-in for the admin 0 layer of an ArcGIS FeatureServer."""
+
+    def __init__(self, ids: list[int] | None) -> None:
+        self.ids = ids
+        self.pages: list[str] = []
+        self.responses: list[Response] = []
+
+    def __call__(self, request: Request) -> Response:
+        """Serve a token, the layer info, its object IDs or a page of them."""
+        path = request.url.path
+        if path.endswith("/generateToken"):
+            return Response(200, json={"token": "token"})
+        if not path.endswith("/query"):
+            return Response(200, json=_LAYER)
+        if request.method == "GET":
+            return Response(200, json={"objectIds": self.ids})
+        where = parse_qs(request.content.decode())["where"][0]
+        self.pages.append(where)
+        if self.responses:
+            return self.responses.pop(0)
+        low, high = (int(x) for x in re.findall(r"\d+", where))
+        features = [
+            {"attributes": {"OBJECTID": x, "iso3cd": f"A{x}"}}
+            for x in sorted(self.ids or [])
+            if low <= x <= high
+        ]
+        return Response(200, json={"fields": _LAYER["fields"], "features": features})
+
+
+def _client(server: _FeatureServer) -> Client:
+    """Return a client of the stand-in server."""
+    return Client(transport=MockTransport(server))
+
+
+class TestAdmin0:
+    """Test downloading admin 0 from the FeatureServer."""
+
+    def test_fetch_pages(self) -> None:
+        """Test that sparse object IDs are fetched in pages of ID ranges."""
+        server = _FeatureServer(_IDS)
+        with _client(server) as client:
+            pages = _fetch_pages(client, _LAYER, {"f": "json"})
+        assert sorted(server.pages, key=len) == [
+            "OBJECTID >= 3 AND OBJECTID <= 7",
+            "OBJECTID >= 10 AND OBJECTID <= 11",
+            "OBJECTID >= 400 AND OBJECTID <= 400",
+        ]
+        ids = [x["attributes"]["OBJECTID"] for page in pages for x in page["features"]]
+        assert ids == sorted(_IDS)
+
+    def test_unchanged(self, tmp_path: Path) -> None:
+        """Test that the download is skipped when the layer is unchanged."""
+        output_file = tmp_path / "bnda_cty.parquet"
+        version_file = tmp_path / "bnda_cty.version"
+        output_file.write_bytes(b"")
+        version_file.write_text("1700000000000")
+        server = _FeatureServer(_IDS)
+        with _client(server) as client:
+            assert _fetch_if_changed(client, output_file, version_file) is None
+        assert server.pages == []
+        version_file.write_text("1600000000000")
+        with _client(server) as client:
+            fetched = _fetch_if_changed(client, output_file, version_file)
+        assert fetched is not None
+        assert fetched[1] == "1700000000000"
+
+    def test_empty_layer(self, tmp_path: Path) -> None:
+        """Test that an empty layer keeps the last download, or fails."""
+        output_file = tmp_path / "bnda_cty.parquet"
+        version_file = tmp_path / "bnda_cty.version"
+        server = _FeatureServer(None)
+        with _client(server) as client:
+            assert _fetch_pages(client, _LAYER, {"f": "json"}) == []
+            with pytest.raises(ValueError, match="empty"):
+                _fetch_if_changed(client, output_file, version_file)
+            output_file.write_bytes(b"")
+            assert _fetch_if_changed(client, output_file, version_file) is None
+
+    @pytest.mark.parametrize(
+        ("response", "error", "match"),
+        [
+            (
+                Response(200, json={"features": [], "exceededTransferLimit": True}),
+                ValueError,
+                "record limit",
+            ),
+            (Response(200, json={"fields": []}), ValueError, "without features"),
+            (Response(400, json={}), HTTPStatusError, "400"),
+        ],
+    )
+    def test_page_not_retried(
+        self, response: Response, error: type[Exception], match: str
+    ) -> None:
+        """Test that a page that would come back the same fails at once."""
+        server = _FeatureServer(_IDS)
+        server.responses = [response]
+        fetch_page = _fetch_page.retry_with(wait=wait_none())
+        with _client(server) as client, pytest.raises(error, match=match):
+            fetch_page(client, {"f": "json"}, "OBJECTID >= 3 AND OBJECTID <= 7")
+        assert len(server.pages) == 1
+
+    def test_page_retried(self) -> None:
+        """Test that a server error is retried."""
+        server = _FeatureServer(_IDS)
+        server.responses = [Response(503, json={}), Response(502, json={})]
+        fetch_page = _fetch_page.retry_with(wait=wait_none())
+        with _client(server) as client:
+            page = fetch_page(client, {"f": "json"}, "OBJECTID >= 3 AND OBJECTID <= 7")
+        assert len(server.pages) == 3
+        assert [x["attributes"]["OBJECTID"] for x in page["features"]] == [3, 7]
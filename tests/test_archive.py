@@ -0,0 +1,69 @@
+from os import utime
+from pathlib import Path
+from zipfile import ZipFile
+
+import pytest
+
+from hdx.scraper.buildings.common import archive
+from hdx.scraper.buildings.common.archive import _CHUNK_SIZE, zip_directory
+
+
+@pytest.fixture
+def input_dir(tmp_path: Path) -> Path:
+    """Write a directory with nested and empty ones, and files of every size."""
+    input_dir = tmp_path / "aaa_buildings.gdb"
+    (input_dir / "nested" / "deeper").mkdir(parents=True)
+    (input_dir / "empty_dir").mkdir()
+    (input_dir / "empty.gdbtable").write_bytes(b"")
+    (input_dir / "small.gdbtable").write_bytes(b"buildings" * 10)
+    large = b"".join(i.to_bytes(4, "little") for i in range(_CHUNK_SIZE // 2))
+    (input_dir / "nested" / "large.gdbtable").write_bytes(large)
+    (input_dir / "nested" / "deeper" / "bâtiments_ñ.gdbtable").write_bytes(b"x")
+    return input_dir
+
+
+def _check_zip(input_dir: Path, output_zip: Path) -> None:
+    """Check that a zip holds exactly the contents of input_dir."""
+    with ZipFile(output_zip) as zf:
+        assert zf.testzip() is None
+        names = zf.namelist()
+        expected = sorted(
+            x.relative_to(input_dir).as_posix() + ("/" if x.is_dir() else "")
+            for x in input_dir.rglob("*")
+        )
+        assert sorted(names) == expected
+        for name in names:
+            path = input_dir / name
+            if path.is_file():
+                assert zf.read(name) == path.read_bytes()
+
+
+class TestArchive:
+    """Test the parallel zip writer."""
+
+    def test_round_trip(self, input_dir: Path, tmp_path: Path) -> None:
+        """Test that every member reads back as it was written."""
+        assert (input_dir / "nested" / "large.gdbtable").stat().st_size > _CHUNK_SIZE
+        output_zip = tmp_path / "aaa_buildings.gdb.zip"
+        zip_directory(input_dir, output_zip)
+        _check_zip(input_dir, output_zip)
+
+    def test_digest_ignores_mtime(self, input_dir: Path, tmp_path: Path) -> None:
+        """Test that the digest follows the contents, not modification times."""
+        output_zip = tmp_path / "aaa_buildings.gdb.zip"
+        digest = zip_directory(input_dir, output_zip)
+        for path in input_dir.rglob("*"):
+            utime(path, (0, 315532800))  # 1980-01-01
+        assert zip_directory(input_dir, output_zip) == digest
+        (input_dir / "small.gdbtable").write_bytes(b"changed")
+        assert zip_directory(input_dir, output_zip) != digest
+
+    def test_zip64(
+        self, input_dir: Path, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> None:
+        """Test that sizes and offsets over the ZIP64 limit read back."""
+        monkeypatch.setattr(archive, "_ZIP64_LIMIT", 64)
+        output_zip = tmp_path / "aaa_buildings.gdb.zip"
+        zip_directory(input_dir, output_zip)
+        assert b"PK\x06\x06" in output_zip.read_bytes()[-200:]
+        _check_zip(input_dir, output_zip)
@@ -0,0 +1,64 @@
+from threading import Timer
+from time import monotonic
+
+import pytest
+
+from hdx.scraper.buildings.common import budget as budget_module
+from hdx.scraper.buildings.common.budget import DiskBudget
+
+
+def _budget(capacity: int) -> DiskBudget:
+    """Return a budget of capacity bytes."""
+    budget = DiskBudget("Test")
+    budget.capacity = capacity
+    return budget
+
+
+class TestDiskBudget:
+    """Test admission against the disk budget."""
+
+    def test_fits(self) -> None:
+        """Test that jobs are admitted while they fit, and after a release."""
+        budget = _budget(100)
+        assert budget.try_reserve("A", 60)
+        assert not budget.try_reserve("B", 60)
+        budget.release("A")
+        assert budget.try_reserve("B", 60)
+        assert budget.reserved == 60
+
+    def test_oversized_runs_alone(self) -> None:
+        """Test that a job bigger than the budget runs once no other job does."""
+        budget = _budget(100)
+        assert budget.try_reserve("A", 10)
+        assert not budget.try_reserve("B", 270)
+        budget.release("A")
+        assert budget.try_reserve("B", 270)
+
+    def test_partition_shares_do_not_block(self) -> None:
+        """Test that space held for jobs not started cannot stall the rest."""
+        budget = _budget(100)
+        budget.hold("A", 45)
+        budget.hold("B", 45)
+        assert budget.try_reserve("A", 270)
+        assert budget.reserved == 315
+        assert not budget.try_reserve("B", 270)
+        budget.release("A")
+        assert budget.try_reserve("B", 270)
+        budget.release("B")
+        assert budget.reserved == 0
+
+    def test_release_from_another_thread(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Test that a job held for starts as soon as another thread releases."""
+        monkeypatch.setattr(budget_module, "BUDGET_POLL", 60)
+        budget = _budget(100)
+        budget.hold("B", 40)
+        assert budget.try_reserve("A", 80)
+        assert not budget.try_reserve("B", 60)
+        timer = Timer(0.05, budget.release, ["A"])
+        start = monotonic()
+        timer.start()
+        budget.reserve("B", 60)
+        timer.join()
+        assert monotonic() - start < 5
+        assert budget.reserved == 60
+        assert budget.high_water == 120
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import pytest
+
+from hdx.scraper.buildings.common import changes, state
+from hdx.scraper.buildings.common.changes import (
+    changed_countries,
+    input_fingerprints,
+    record_country,
+)
+
+_INPUTS = {
+    "AAA": ("boundary", {("tile_1.csv.gz", "etag1"), ("tile_2.csv.gz", "etag2")}),
+}
+
+
+@pytest.fixture
+def inputs(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> dict:
+    """Serve each country's current inputs from a dict, with state in tmp_path."""
+    monkeypatch.setattr(state, "STATE_DB", tmp_path / "state.sqlite")
+    current = {k: (v[0], set(v[1])) for k, v in _INPUTS.items()}
+    monkeypatch.setattr(
+        changes,
+        "_current_inputs",
+        lambda _, iso3s: {x: current[x] for x in iso3s if x in current},
+    )
+    return current
+
+
+def _publish(iso3: str) -> None:
+    """Record a country as published from its current inputs."""
+    record_country("google", iso3, input_fingerprints("google", [iso3])[iso3])
+
+
+class TestChanges:
+    """Test deciding which countries to regroup."""
+
+    def test_unchanged_skipped(self, inputs: dict) -> None:  # noqa: ARG002
+        """Test that a country is skipped only once published from its inputs."""
+        assert changed_countries("google", ["AAA"]) == ["AAA"]
+        _publish("AAA")
+        assert changed_countries("google", ["AAA"]) == []
+
+    def test_tile_changed(self, inputs: dict) -> None:
+        """Test that a country is regrouped after a source file changes."""
+        _publish("AAA")
+        inputs["AAA"][1].discard(("tile_2.csv.gz", "etag2"))
+        inputs["AAA"][1].add(("tile_2.csv.gz", "etag3"))
+        assert changed_countries("google", ["AAA"]) == ["AAA"]
+        _publish("AAA")
+        inputs["AAA"][1].add(("tile_3.csv.gz", "etag1"))
+        assert changed_countries("google", ["AAA"]) == ["AAA"]
+
+    def test_boundary_changed(self, inputs: dict) -> None:
+        """Test that a country is regrouped after its boundary changes."""
+        _publish("AAA")
+        inputs["AAA"] = ("new boundary", inputs["AAA"][1])
+        assert changed_countries("google", ["AAA"]) == ["AAA"]
+
+    def test_changed_while_grouped(self, inputs: dict) -> None:
+        """Test that a country whose inputs changed mid-run is not recorded."""
+        fingerprint = input_fingerprints("google", ["AAA"])["AAA"]
+        inputs["AAA"][1].add(("tile_3.csv.gz", "etag1"))
+        record_country("google", "AAA", fingerprint)
+        assert changed_countries("google", ["AAA"]) == ["AAA"]
+
+    def test_not_in_admin0(
+        self,
+        inputs: dict,  # noqa: ARG002
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test that a country missing from admin 0 is regrouped, not recorded."""
+        record_country("google", "BBB", "inputs")
+        assert "BBB: not in the admin 0 boundaries" in caplog.text
+        assert "changed while it was grouped" not in caplog.text
+        assert changed_countries("google", ["BBB"]) == ["BBB"]
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import pytest
+from hdx.api.configuration import Configuration
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+
+from hdx.scraper.buildings.common.gdb import content_hash, zip_gdb
+from hdx.scraper.buildings.dataset import _add_resource
+
+_URL = "https://data.humdata.org/dataset/x/resource/y/download/aaa_buildings.gdb.zip"
+
+
+@pytest.fixture
+def gdb_zip(tmp_path: Path) -> Path:
+    """Configure HDX offline and return a zipped GDB with its content hash."""
+    Configuration._create(  # noqa: SLF001
+        hdx_read_only=True, hdx_site="prod", user_agent="test"
+    )
+    Resource.set_formatsdict({"geodatabase": "Geodatabase"})
+    output_gdb = tmp_path / "aaa_buildings.gdb"
+    output_gdb.mkdir()
+    (output_gdb / "a00000001.gdbtable").write_bytes(b"buildings")
+    return zip_gdb(output_gdb)
+
+
+def _published(digest: str | None) -> Resource:
+    """Stand in for the resource on HDX, with the given content hash."""
+    published = Resource({"name": "aaa_buildings.gdb.zip", "url": _URL})
+    if digest:
+        published["content_sha256"] = digest
+    return published
+
+
+class TestDataset:
+    """Test adding resources to datasets."""
+
+    def test_unchanged_metadata_only(self, gdb_zip: Path) -> None:
+        """Test that unchanged contents update the metadata without the file."""
+        dataset = Dataset({"name": "buildings-google-aaa"})
+        _add_resource(dataset, gdb_zip, _published(content_hash(gdb_zip)))
+        resource = dataset.get_resources()[0]
+        assert resource.get_file_to_upload() is None
+        assert resource["url"] == _URL
+        assert resource["url_type"] == "upload"
+        assert resource["content_sha256"] == content_hash(gdb_zip)
+
+    @pytest.mark.parametrize("digest", [None, "0" * 64])
+    def test_changed_uploads(self, gdb_zip: Path, digest: str | None) -> None:
+        """Test that new or changed contents upload the file."""
+        dataset = Dataset({"name": "buildings-google-aaa"})
+        _add_resource(dataset, gdb_zip, _published(digest))
+        resource = dataset.get_resources()[0]
+        assert resource.get_file_to_upload() == str(gdb_zip)
+        assert resource["content_sha256"] == content_hash(gdb_zip)
@@ -0,0 +1,144 @@
+import json
+from asyncio import run
+from collections.abc import AsyncIterator, Callable
+from pathlib import Path
+
+import pytest
+from httpx import (
+    AsyncByteStream,
+    AsyncClient,
+    MockTransport,
+    ReadError,
+    Request,
+    Response,
+)
+
+from hdx.scraper.buildings.common import download
+from hdx.scraper.buildings.common.download import _download_ranges
+from hdx.scraper.buildings.common.pipeline import AdaptiveLimit
+
+_URL = "https://example.com/tile.csv.gz"
+_DATA = bytes(range(256)) * 40
+
+
+class _Stream(AsyncByteStream):
+    """Body that drops the connection after a number of bytes."""
+
+    def __init__(self, data: bytes, drop_after: int | None) -> None:
+        self.data = data
+        self.drop_after = drop_after
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Yield the body in small chunks, then fail if it is cut short."""
+        end = len(self.data) if self.drop_after is None else self.drop_after
+        for i in range(0, end, 100):
+            yield self.data[i : min(i + 100, end)]
+        if self.drop_after is not None:
+            msg = "connection dropped"
+            raise ReadError(msg)
+
+
+class _Server:
+    """Stand-in for a server of one file supporting Range and If-Range."""
+
+    def __init__(self, etag: str = '"v1"') -> None:
+        self.etag = etag
+        self.data = _DATA
+        self.drop_after: int | None = None
+        self.ranges: list[str] = []
+
+    def __call__(self, request: Request) -> Response:
+        """Serve a HEAD, a full GET or a ranged GET of the file."""
+        headers = {"ETag": self.etag, "Content-Length": str(len(self.data))}
+        if request.method == "HEAD":
+            return Response(200, headers=headers)
+        byte_range = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        if byte_range is None or (if_range and if_range != self.etag):
+            return Response(200, headers=headers, stream=_Stream(self.data, None))
+        self.ranges.append(byte_range)
+        start, end = (int(x) for x in byte_range.removeprefix("bytes=").split("-"))
+        body = self.data[start : end + 1]
+        return Response(
+            206,
+            headers={"ETag": self.etag, "Content-Length": str(len(body))},
+            stream=_Stream(body, self.drop_after),
+        )
+
+
+async def _download(server: Callable[[Request], Response], output_path: Path) -> None:
+    """Download the file from the stand-in server."""
+    async with AsyncClient(transport=MockTransport(server)) as client:
+        await _download_ranges(client, _URL, output_path, AdaptiveLimit("Download", 1))
+
+
+@pytest.fixture(autouse=True)
+def small_ranges(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Split even a small file in two ranges, saving progress every chunk."""
+    monkeypatch.setattr(download, "DOWNLOAD_RANGES", 2)
+    monkeypatch.setattr(download, "DOWNLOAD_RANGE_MIN", 1)
+    monkeypatch.setattr(download, "DOWNLOAD_STATE_INTERVAL", 1)
+
+
+class TestDownload:
+    """Test resumable range downloads."""
+
+    def test_resume(self, tmp_path: Path) -> None:
+        """Test that a dropped download resumes from the bytes it saved."""
+        output_path = tmp_path / "tile.csv.gz"
+        state_path = tmp_path / "tile.csv.gz.json"
+        server = _Server()
+        server.drop_after = 1000
+        with pytest.raises(ExceptionGroup):
+            run(_download(server, output_path))
+        saved = json.loads(state_path.read_text())["ranges"]
+        assert 0 < saved[0][0] <= 1000
+        server.drop_after = None
+        server.ranges.clear()
+        run(_download(server, output_path))
+        assert sorted(server.ranges) == [f"bytes={x}-{y}" for x, y in saved]
+        assert output_path.read_bytes() == _DATA
+        assert not state_path.exists()
+
+    def test_changed_before_resume(self, tmp_path: Path) -> None:
+        """Test that a file with a new ETag is downloaded again from the start."""
+        output_path = tmp_path / "tile.csv.gz"
+        server = _Server()
+        server.drop_after = 1000
+        with pytest.raises(ExceptionGroup):
+            run(_download(server, output_path))
+        server.drop_after = None
+        server.etag = '"v2"'
+        server.data = _DATA[::-1]
+        server.ranges.clear()
+        run(_download(server, output_path))
+        half = len(_DATA) // 2
+        assert sorted(server.ranges) == [
+            f"bytes=0-{half - 1}",
+            f"bytes={half}-{len(_DATA) - 1}",
+        ]
+        assert output_path.read_bytes() == _DATA[::-1]
+
+    def test_changed_during_download(self, tmp_path: Path) -> None:
+        """Test that a file changed after the HEAD fails If-Range and restarts."""
+        output_path = tmp_path / "tile.csv.gz"
+        state_path = tmp_path / "tile.csv.gz.json"
+        server = _Server()
+        server.drop_after = 1000
+        with pytest.raises(ExceptionGroup):
+            run(_download(server, output_path))
+        server.drop_after = None
+        server.etag = '"v2"'
+
+        def head_before_change(request: Request) -> Response:
+            if request.method == "HEAD":
+                headers = {"ETag": '"v1"', "Content-Length": str(len(_DATA))}
+                return Response(200, headers=headers)
+            return server(request)
+
+        with pytest.raises(ExceptionGroup) as excinfo:
+            run(_download(head_before_change, output_path))
+        assert excinfo.group_contains(ValueError, match="changed during download")
+        assert not state_path.exists()
+        run(_download(server, output_path))
+        assert output_path.read_bytes() == _DATA
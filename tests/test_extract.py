@@ -0,0 +1,115 @@
+import logging
+from pathlib import Path
+
+import pytest
+
+from hdx.scraper.buildings.common import admin0, engine, extract
+from hdx.scraper.buildings.common.admin0 import cache_admin0
+from hdx.scraper.buildings.common.engine import engine as duckdb_engine
+from hdx.scraper.buildings.common.extract import extract_country_buildings
+
+_MB = 1024 * 1024
+
+# Buildings as (id, xmin, ymin, size) around country AAA, the square 0-10.
+# The grid of 2 x 2 tiles over AAA has its inner edges at 5.
+_BUILDINGS = [
+    (1, 1, 1, 1),  # inside a tile
+    (2, 5, 5, 1),  # corner on both inner edges
+    (3, 4.5, 2, 1),  # across an inner edge
+    (4, 5, 8, 0.5),  # corner on an inner edge
+    (5, -0.5, 3, 1),  # across the country edge, corner outside its bbox
+    (6, 9.5, 9.5, 1),  # across the far corner of the country
+    (7, 10, 4, 1),  # touching the country edge
+    (8, -5, 5, 1),  # outside
+    (9, 15, 15, 1),  # outside
+    (10, 4.999, 4.999, 0.001),  # up to the inner edges
+]
+
+
+@pytest.fixture
+def source(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> tuple[str, Path]:
+    """Write a country, its admin 0 cache, and source files with a manifest."""
+    # A DuckDB session keeps the adm0 tables of the last test
+    engine._engine.cache_clear()  # noqa: SLF001
+    adm0 = tmp_path / "bnda_cty.parquet"
+    cache = tmp_path / "adm0_cache"
+    monkeypatch.setattr(admin0, "GLOBAL_ADM0", adm0)
+    monkeypatch.setattr(admin0, "ADM0_CACHE", cache)
+    monkeypatch.setattr(engine, "ADM0_CACHE", cache)
+    buildings = ",".join(str(x) for x in _BUILDINGS)
+    with duckdb_engine() as con:
+        con.sql(f"""
+            COPY (
+                SELECT
+                    'AAA' AS iso3cd,
+                    ST_GeomFromText('POLYGON((0 0, 10 0, 10 10, 0 10, 0 0))')
+                    AS geometry
+            )
+            TO '{adm0}';
+        """)
+        cache_admin0()
+        for half, where in enumerate(("id % 2 = 0", "id % 2 = 1")):
+            con.sql(f"""
+                COPY (
+                    SELECT
+                        id,
+                        ST_MakeEnvelope(x, y, x + size, y + size) AS geometry,
+                        {{
+                            'xmin': x,
+                            'ymin': y,
+                            'xmax': x + size,
+                            'ymax': y + size
+                        }} AS geometry_bbox
+                    FROM (VALUES {buildings}) AS t(id, x, y, size)
+                    WHERE {where}
+                )
+                TO '{tmp_path / f"source_{half}.parquet"}';
+            """)
+        manifest = tmp_path / "manifest.parquet"
+        con.sql(f"""
+            COPY (
+                SELECT
+                    filename AS path,
+                    count(*) AS num_rows,
+                    {2 * _MB} AS size,
+                    '' AS etag,
+                    min(geometry_bbox.xmin) AS xmin,
+                    min(geometry_bbox.ymin) AS ymin,
+                    max(geometry_bbox.xmax) AS xmax,
+                    max(geometry_bbox.ymax) AS ymax
+                FROM read_parquet('{tmp_path}/source_*.parquet', filename = true)
+                GROUP BY filename
+            )
+            TO '{manifest}';
+        """)
+    return f"{tmp_path}/source_*.parquet", manifest
+
+
+def _extracted_ids(source: tuple[str, Path], output_gpq: Path) -> list[int]:
+    """Extract country AAA and return the IDs of its buildings, sorted."""
+    input_path, manifest = source
+    assert extract_country_buildings("AAA", input_path, output_gpq, manifest)
+    with duckdb_engine() as con:
+        rows = con.sql(f"SELECT id FROM '{output_gpq}' ORDER BY id").fetchall()
+    return [row[0] for row in rows]
+
+
+class TestExtract:
+    """Test extracting a country's buildings."""
+
+    def test_tiles_match_whole(
+        self,
+        source: tuple[str, Path],
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+        caplog: pytest.LogCaptureFixture,
+    ) -> None:
+        """Test that tiles take each building exactly once, as a whole pass."""
+        monkeypatch.setattr(extract, "EXTRACT_TILE_MB", 0)
+        whole = _extracted_ids(source, tmp_path / "whole.parquet")
+        assert whole == [1, 2, 3, 4, 5, 6, 7, 10]
+        monkeypatch.setattr(extract, "EXTRACT_TILE_MB", 1)
+        caplog.set_level(logging.INFO)
+        tiled = _extracted_ids(source, tmp_path / "tiled.parquet")
+        assert tiled == whole
+        assert "Extracting AAA in 2 x 2 tiles" in caplog.text
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pytest
+
+from hdx.scraper.buildings.common import group as group_module
+from hdx.scraper.buildings.common import state
+from hdx.scraper.buildings.common.group import group
+from hdx.scraper.buildings.common.journal import (
+    CONVERTED,
+    EXTRACTED,
+    ZIPPED,
+    journal_stage,
+    record_stage,
+)
+
+_FINGERPRINT = "inputs"
+
+
+@pytest.fixture
+def extracts(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> list[str]:
+    """Journal in a temporary state store, and record every extraction.
+
+    Extraction finds no buildings, so group stops right after it.
+    """
+    monkeypatch.setattr(state, "STATE_DB", tmp_path / "state.sqlite")
+    calls = []
+
+    def extract(_provider: str, iso3: str, *_args: object) -> bool:
+        calls.append(iso3)
+        return False
+
+    monkeypatch.setattr(group_module, "_extract", extract)
+    return calls
+
+
+class TestGroup:
+    """Test resuming grouping from the journal."""
+
+    @pytest.mark.parametrize("stage", [EXTRACTED, CONVERTED, ZIPPED])
+    def test_restart_when_files_gone(
+        self, extracts: list[str], tmp_path: Path, stage: str
+    ) -> None:
+        """Test that a stage whose files are gone starts again from scratch."""
+        record_stage("google", "AAA", _FINGERPRINT, stage)
+        group("google", "AAA", tmp_path / "aaa", fingerprint=_FINGERPRINT)
+        assert extracts == ["AAA"]
+
+    def test_resume_zipped(self, extracts: list[str], tmp_path: Path) -> None:
+        """Test that a zipped country with its zips in place is left as is."""
+        output_dir = tmp_path / "aaa"
+        output_dir.mkdir()
+        (output_dir / "aaa_buildings.gdb.zip").write_bytes(b"")
+        record_stage("google", "AAA", _FINGERPRINT, ZIPPED)
+        group("google", "AAA", output_dir, fingerprint=_FINGERPRINT)
+        assert extracts == []
+        assert journal_stage("google", "AAA", _FINGERPRINT) == ZIPPED
@@ -0,0 +1,188 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+from hdx.api.configuration import Configuration
+from hdx.api.locations import Locations
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
+from hdx.location.country import Country
+
+from hdx.scraper.buildings import __main__ as main_module
+from hdx.scraper.buildings.common import state
+from hdx.scraper.buildings.common.budget import DiskBudget
+from hdx.scraper.buildings.common.gdb import zip_gdb
+from hdx.scraper.buildings.common.journal import (
+    EXTRACTED,
+    PUBLISHED,
+    journal_stage,
+    record_stage,
+)
+
+_PARTS = ["afg_buildings_1.gdb", "afg_buildings_2.gdb", "afg_buildings_3.gdb"]
+
+
+@pytest.fixture
+def created(monkeypatch: pytest.MonkeyPatch) -> list[Dataset]:
+    """Configure HDX offline and record the datasets created in it.
+
+    Nothing is on HDX yet, and tags, which are checked against HDX, are left
+    out.
+    """
+    Configuration._create(  # noqa: SLF001
+        hdx_read_only=True, hdx_site="prod", user_agent="test"
+    )
+    Country.set_use_live_default(False)
+    Locations.set_validlocations([{"name": "afg", "title": "Afghanistan"}])
+    Resource.set_formatsdict({"geodatabase": "Geodatabase"})
+    monkeypatch.setattr(Dataset, "read_from_hdx", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(Dataset, "add_tags", lambda *_args, **_kwargs: None)
+    calls = []
+
+    def create_in_hdx(self: Dataset, **_kwargs: object) -> None:
+        calls.append(self)
+
+    monkeypatch.setattr(Dataset, "create_in_hdx", create_in_hdx)
+    return calls
+
+
+class TestPackage:
+    """Test publishing a country's dataset."""
+
+    def test_all_parts_published(self, created: list[Dataset], tmp_path: Path) -> None:
+        """Test that every part is a resource of a single dataset update."""
+        output_dir = tmp_path / "afg"
+        output_dir.mkdir()
+        for part in _PARTS:
+            output_gdb = output_dir / part
+            output_gdb.mkdir()
+            (output_gdb / "a00000001.gdbtable").write_bytes(part.encode())
+            zip_gdb(output_gdb)
+        main_module._package("google", "AFG", output_dir, "batch")  # noqa: SLF001
+        assert len(created) == 1
+        assert created[0]["name"] == "buildings-google-afg"
+        resources = created[0].get_resources()
+        assert [x["name"] for x in resources] == [f"{x}.zip" for x in _PARTS]
+        assert all(x.get_file_to_upload() for x in resources)
+
+
+@pytest.fixture
+def partitioned(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> list[str]:
+    """Run countries AAA and BBB through grouping and publishing, in tmp_path.
+
+    Their inputs are unchanged, grouping does nothing and publishing finds
+    no resources, unless _package is patched again. Records the countries
+    partitioned.
+    """
+    monkeypatch.setattr(state, "STATE_DB", tmp_path / "state.sqlite")
+    monkeypatch.setattr(main_module, "data_dir", tmp_path)
+    monkeypatch.setattr(main_module, "_LOOKUP", str(tmp_path / "lookup"))
+    monkeypatch.setattr(main_module, "RUN_PARTITION", True)
+    monkeypatch.setattr(main_module, "GROUPING_WORKERS", 1)
+    monkeypatch.setattr(main_module, "_country_codes", lambda _: ["AAA", "BBB"])
+    monkeypatch.setattr(main_module, "changed_countries", lambda _, x: x)
+    monkeypatch.setattr(
+        main_module, "input_fingerprints", lambda _, x: dict.fromkeys(x, "inputs")
+    )
+    monkeypatch.setattr(main_module, "country_source_bytes", lambda *_: {})
+    monkeypatch.setattr(main_module, "group_country", lambda *_: None)
+    monkeypatch.setattr(main_module, "_package", lambda *_: False)
+    calls = []
+    monkeypatch.setattr(
+        main_module, "partition_buildings", lambda _, __, x, ___: calls.extend(x)
+    )
+    return calls
+
+
+class TestResume:
+    """Test resuming an interrupted grouping run."""
+
+    def test_lost_stage_partitioned(
+        self, partitioned: list[str], tmp_path: Path
+    ) -> None:
+        """Test that a country whose stage files are gone is partitioned again.
+
+        Neither country published anything, so neither is recorded as such.
+        """
+        record_stage("google", "AAA", "inputs", EXTRACTED)
+        record_stage("google", "BBB", "inputs", EXTRACTED)
+        output_dir = tmp_path / "google" / "outputs" / "bbb"
+        output_dir.mkdir(parents=True)
+        (output_dir / "bbb_buildings.parquet").write_bytes(b"")
+        main_module._group_and_package("google")  # noqa: SLF001
+        assert partitioned == ["AAA"]
+        assert journal_stage("google", "AAA", "inputs") == EXTRACTED
+        assert journal_stage("google", "BBB", "inputs") == EXTRACTED
+
+    def test_one_batch(
+        self,
+        partitioned: list[str],  # noqa: ARG002
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ) -> None:
+        """Test that every publisher creates its datasets in the same batch."""
+        batches = {}
+
+        def package(_provider: str, iso3: str, _output_dir: Path, batch: str) -> bool:
+            batches[iso3] = batch
+            return True
+
+        monkeypatch.setattr(main_module, "_package", package)
+        monkeypatch.setattr(main_module, "record_country", lambda *_: None)
+        main_module._group_and_package("google")  # noqa: SLF001
+        assert batches.keys() == {"AAA", "BBB"}
+        assert len(set(batches.values())) == 1
+        assert journal_stage("google", "AAA", "inputs") == PUBLISHED
+        assert journal_stage("google", "BBB", "inputs") == PUBLISHED
+        assert not (tmp_path / "lookup").exists()
+
+
+class _Pool:
+    """Stand-in for the grouping workers, of which the first pool dies.
+
+    The first country submitted to a dying pool kills its worker, and the
+    next submit finds the pool broken.
+    """
+
+    pools = 0
+
+    def __init__(self) -> None:
+        _Pool.pools += 1
+        self.dying = _Pool.pools == 1
+        self.broken = False
+
+    def submit(self, _fn: object, *_args: object) -> Future:
+        """Run a job, or fail it as a dying or broken pool would."""
+        future = Future()
+        if not self.dying:
+            future.set_result(None)
+            return future
+        if self.broken:
+            raise BrokenProcessPool
+        self.broken = True
+        future.set_exception(BrokenProcessPool())
+        return future
+
+    def shutdown(self, **_kwargs: object) -> None:
+        """Stop nothing."""
+
+
+class TestGroupInParallel:
+    """Test grouping countries in worker processes."""
+
+    def test_broken_pool(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Test that the workers restart after one dies, releasing its space."""
+        monkeypatch.setattr(_Pool, "pools", 0)
+        monkeypatch.setattr(main_module, "_grouping_pool", _Pool)
+        monkeypatch.setattr(main_module, "GROUPING_WORKERS", 2)
+        budget = DiskBudget("Test")
+        budget.capacity = 100
+        scratch = {"AAA": 10, "BBB": 20, "CCC": 30}
+        fingerprints = dict.fromkeys(scratch, "inputs")
+        grouped = main_module._group_in_parallel(  # noqa: SLF001
+            "google", fingerprints, None, budget, scratch
+        )
+        assert sorted(grouped) == ["BBB", "CCC"]
+        assert _Pool.pools == 2
+        assert budget.reserved == 50
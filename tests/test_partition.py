@@ -0,0 +1,97 @@
+from pathlib import Path
+
+import pytest
+
+from hdx.scraper.buildings.common import admin0, engine
+from hdx.scraper.buildings.common.admin0 import cache_admin0
+from hdx.scraper.buildings.common.engine import engine as duckdb_engine
+from hdx.scraper.buildings.common.partition import partition_buildings
+
+# Countries as (iso3, xmin, ymin, size), and source files with the country
+# their buildings are in, a square of size 1 at each corner of its bbox
+_COUNTRIES = [("AAA", 0, 0, 10), ("BBB", 20, 0, 10), ("CCC", 40, 0, 10)]
+_FILES = {"a.parquet": "AAA", "b.parquet": "BBB", "c.parquet": "CCC"}
+
+
+@pytest.fixture
+def source(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Path:
+    """Write the countries, their admin 0 cache, source files and manifest.
+
+    The file of CCC is not a parquet file, so reading it fails.
+    """
+    # A DuckDB session keeps the adm0 tables of the last test
+    engine._engine.cache_clear()  # noqa: SLF001
+    adm0 = tmp_path / "bnda_cty.parquet"
+    cache = tmp_path / "adm0_cache"
+    monkeypatch.setattr(admin0, "GLOBAL_ADM0", adm0)
+    monkeypatch.setattr(admin0, "ADM0_CACHE", cache)
+    monkeypatch.setattr(engine, "ADM0_CACHE", cache)
+    countries = ",".join(str(x) for x in _COUNTRIES)
+    with duckdb_engine() as con:
+        con.sql(f"""
+            COPY (
+                SELECT iso3cd, ST_MakeEnvelope(x, y, x + size, y + size) AS geometry
+                FROM (VALUES {countries}) AS t(iso3cd, x, y, size)
+            )
+            TO '{adm0}';
+        """)
+        cache_admin0()
+        for name, (iso3, x, y, size) in zip(_FILES, _COUNTRIES, strict=True):
+            if iso3 == "CCC":
+                (tmp_path / name).write_bytes(b"not parquet")
+                continue
+            con.sql(f"""
+                COPY (
+                    SELECT
+                        id,
+                        ST_MakeEnvelope(x0, y0, x0 + 1, y0 + 1) AS geometry,
+                        {{
+                            'xmin': x0,
+                            'ymin': y0,
+                            'xmax': x0 + 1,
+                            'ymax': y0 + 1
+                        }} AS geometry_bbox
+                    FROM (
+                        VALUES
+                            (1, {x + 1}, {y + 1}),
+                            (2, {x + size - 2}, {y + size - 2})
+                    ) AS t(id, x0, y0)
+                )
+                TO '{tmp_path / name}';
+            """)
+        manifest = tmp_path / "manifest.parquet"
+        rows = ",".join(
+            f"('{tmp_path / name}', {x}, {y}, {x + size}, {y + size})"
+            for name, (_, x, y, size) in zip(_FILES, _COUNTRIES, strict=True)
+        )
+        con.sql(f"""
+            COPY (
+                SELECT *
+                FROM (VALUES {rows}) AS t(path, xmin, ymin, xmax, ymax)
+            )
+            TO '{manifest}';
+        """)
+    return manifest
+
+
+class TestPartition:
+    """Test partitioning buildings by country."""
+
+    def test_reads_overlapping_files(self, source: Path, tmp_path: Path) -> None:
+        """Test that only the files overlapping the countries are read."""
+        output_dir = tmp_path / "partitions"
+        partition_buildings(f"{tmp_path}/*.parquet", output_dir, ["AAA", "BBB"], source)
+        with duckdb_engine() as con:
+            rows = con.sql(f"""
+                SELECT iso3, count(*)
+                FROM read_parquet('{output_dir}/*/*.parquet', hive_partitioning = true)
+                GROUP BY iso3
+                ORDER BY iso3
+            """).fetchall()
+        assert rows == [("AAA", 2), ("BBB", 2)]
+
+    def test_no_overlapping_files(self, source: Path, tmp_path: Path) -> None:
+        """Test that countries no file overlaps leave no partition."""
+        output_dir = tmp_path / "partitions"
+        partition_buildings(f"{tmp_path}/*.parquet", output_dir, ["DDD"], source)
+        assert not output_dir.exists()
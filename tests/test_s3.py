@@ -0,0 +1,139 @@
+from collections.abc import Iterator
+from pathlib import Path
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from hdx.scraper.buildings.common import s3
+from hdx.scraper.buildings.common.config import AWS_ENDPOINT_S3, AWS_REGION
+from hdx.scraper.buildings.common.s3 import (
+    S3Object,
+    _resume_upload,
+    abort_uploads,
+    is_published,
+    list_objects,
+    s3_client,
+    s3_prefix,
+    upload_file,
+)
+
+_PART_SIZE = 5 * 1024 * 1024  # smallest part S3 accepts
+
+
+def _incomplete(key: str) -> list[str]:
+    """Return the IDs of the incomplete uploads of a key."""
+    uploads = s3_client().list_multipart_uploads(Bucket=AWS_ENDPOINT_S3)
+    return [x["UploadId"] for x in uploads.get("Uploads", []) if x["Key"] == key]
+
+
+@pytest.fixture
+def bucket(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    """Return an empty bucket in a local S3 stand-in."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+    s3_client.cache_clear()
+    with mock_aws():
+        boto3.client("s3", region_name=AWS_REGION).create_bucket(
+            Bucket=AWS_ENDPOINT_S3,
+            CreateBucketConfiguration={"LocationConstraint": AWS_REGION},
+        )
+        yield
+    s3_client.cache_clear()
+
+
+class TestS3:
+    """Test the S3 inventory."""
+
+    def test_list_objects(self, bucket: None) -> None:  # noqa: ARG002
+        """Test that every page of every variant is listed."""
+        prefix = s3_prefix("google")
+        client = s3_client()
+        for i in range(1005):
+            client.put_object(
+                Bucket=AWS_ENDPOINT_S3,
+                Key=f"{prefix}parquet/{i}.parquet",
+                Body=b"x",
+            )
+        for subfolder in ("geoparquet-2.0", "geoparquet-1.1"):
+            client.put_object(
+                Bucket=AWS_ENDPOINT_S3,
+                Key=f"{prefix}{subfolder}/0.parquet",
+                Body=b"xy",
+            )
+        client.put_object(
+            Bucket=AWS_ENDPOINT_S3,
+            Key=f"{s3_prefix('microsoft')}parquet/0.parquet",
+            Body=b"x",
+        )
+        inventory = list_objects("google")
+        assert len(inventory) == 1007
+        assert inventory["parquet/1004.parquet"] == S3Object(
+            1, "9dd4e461268c8034f5c8564e155c67a6"
+        )
+        assert inventory["geoparquet-2.0/0.parquet"].size == 2
+        assert is_published(inventory, "0.parquet")
+        assert not is_published(inventory, "1.parquet")
+        assert not is_published(inventory, "1005.parquet")
+
+    def test_resume_upload(self, bucket: None) -> None:  # noqa: ARG002
+        """Test that the latest upload is resumed and older ones aborted."""
+        client = s3_client()
+        key = "hdx/google-open-buildings/parquet/0.parquet"
+        upload_id, uploaded = _resume_upload(key)
+        assert uploaded == {}
+        assert _incomplete(key) == [upload_id]
+        latest = client.create_multipart_upload(Bucket=AWS_ENDPOINT_S3, Key=key)
+        response = client.upload_part(
+            Bucket=AWS_ENDPOINT_S3,
+            Key=key,
+            UploadId=latest["UploadId"],
+            PartNumber=1,
+            Body=b"x" * _PART_SIZE,
+        )
+        resumed_id, uploaded = _resume_upload(key)
+        assert resumed_id == latest["UploadId"]
+        assert uploaded == {1: response["ETag"].strip('"')}
+        assert _incomplete(key) == [resumed_id]
+        abort_uploads(key)
+        assert _incomplete(key) == []
+
+    def test_upload_file_resumes(
+        self,
+        bucket: None,  # noqa: ARG002
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ) -> None:
+        """Test that a resumed upload sends only the parts not already sent.
+
+        Part 1 was sent with other contents, so it is sent again.
+        """
+        monkeypatch.setattr(s3, "UPLOAD_PART_SIZE", _PART_SIZE)
+        client = s3_client()
+        key = "hdx/google-open-buildings/parquet/0.parquet"
+        data = b"a" * _PART_SIZE + b"b" * _PART_SIZE + b"c"
+        input_path = tmp_path / "0.parquet"
+        input_path.write_bytes(data)
+        upload = client.create_multipart_upload(Bucket=AWS_ENDPOINT_S3, Key=key)
+        for part_number, body in ((1, b"x"), (2, b"b")):
+            client.upload_part(
+                Bucket=AWS_ENDPOINT_S3,
+                Key=key,
+                UploadId=upload["UploadId"],
+                PartNumber=part_number,
+                Body=body * _PART_SIZE,
+            )
+        sent = []
+        upload_part = client.upload_part
+
+        def spy(**kwargs: object) -> dict:
+            sent.append(kwargs["PartNumber"])
+            return upload_part(**kwargs)
+
+        monkeypatch.setattr(client, "upload_part", spy)
+        upload_file(input_path, key)
+        assert sorted(sent) == [1, 3]
+        body = client.get_object(Bucket=AWS_ENDPOINT_S3, Key=key)["Body"].read()
+        assert body == data
+        assert _incomplete(key) == []
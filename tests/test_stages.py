@@ -0,0 +1,138 @@
+from asyncio import run, sleep, wait_for
+
+import pytest
+
+from hdx.scraper.buildings.common import budget, pipeline
+from hdx.scraper.buildings.common.budget import DiskBudget
+from hdx.scraper.buildings.common.config import ADAPT_INTERVAL
+from hdx.scraper.buildings.common.pipeline import AdaptiveLimit, Stage, run_stages
+
+
+class _Clock:
+    """Stand-in for monotonic, moved on by hand."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Return the current time."""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> _Clock:
+    """Replace the clock of the adaptive limits."""
+    clock = _Clock()
+    monkeypatch.setattr(pipeline, "monotonic", clock)
+    return clock
+
+
+async def _transfer(limit: AdaptiveLimit, clock: _Clock, nbytes: int) -> None:
+    """Transfer nbytes in a slot of limit over an interval."""
+    async with limit.acquire():
+        limit.record(nbytes)
+        clock.now += ADAPT_INTERVAL
+
+
+async def _fail(limit: AdaptiveLimit) -> None:
+    """Fail a task in a slot of limit."""
+    async with limit.acquire():
+        msg = "transfer failed"
+        raise ValueError(msg)
+
+
+class TestAdaptiveLimit:
+    """Test limits that follow throughput and errors."""
+
+    def test_throughput(self, clock: _Clock) -> None:
+        """Test that the limit rises with throughput and falls with it."""
+        limit = AdaptiveLimit("Test", 8)
+        assert limit.limit == 4
+        for nbytes in (100, 200, 300):
+            run(_transfer(limit, clock, nbytes))
+        assert limit.limit == 7
+        run(_transfer(limit, clock, 302))
+        assert limit.limit == 7
+        run(_transfer(limit, clock, 100))
+        assert limit.limit == 6
+        for nbytes in (1000, 2000, 3000):
+            run(_transfer(limit, clock, nbytes))
+        assert limit.limit == 8
+
+    def test_error(self, clock: _Clock) -> None:
+        """Test that an error halves the limit, down to one."""
+        limit = AdaptiveLimit("Test", 8)
+        run(_transfer(limit, clock, 100))
+        assert limit.limit == 5
+        for expected in (2, 1, 1):
+            with pytest.raises(ValueError, match="transfer failed"):
+                run(_fail(limit))
+            assert limit.limit == expected
+
+
+class TestRunStages:
+    """Test passing items through stages."""
+
+    def test_order(self) -> None:
+        """Test that items go through every stage in order, or are dropped."""
+        seen = []
+
+        async def double(item: int) -> int:
+            await sleep(0.001 * (item % 3))
+            return item * 2
+
+        async def drop_small(item: int) -> int | None:
+            return item if item > 4 else None
+
+        async def collect(item: int) -> None:
+            seen.append(item)
+
+        stages = [
+            Stage("double", double, 3),
+            Stage("drop", drop_small, 2),
+            Stage("collect", collect, 1),
+        ]
+        run(run_stages(range(6), stages))
+        assert sorted(seen) == [6, 8, 10]
+
+    def test_failure_stops(self) -> None:
+        """Test that a failed stage stops the pipeline rather than hanging it."""
+        started = []
+
+        async def start(item: int) -> int:
+            started.append(item)
+            return item
+
+        async def fail(item: int) -> None:
+            if item == 2:
+                msg = "stage failed"
+                raise ValueError(msg)
+
+        stages = [Stage("start", start, 1), Stage("fail", fail, 1)]
+        with pytest.raises(ExceptionGroup) as excinfo:
+            run(wait_for(run_stages(range(100), stages), timeout=5))
+        assert excinfo.group_contains(ValueError, match="stage failed")
+        assert len(started) < 100
+
+    def test_failure_stops_admission(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Test that a failure stops a stage waiting for the disk budget."""
+        monkeypatch.setattr(budget, "BUDGET_POLL", 0.01)
+        disk = DiskBudget("Test")
+        disk.capacity = 100
+        admitted = []
+
+        async def admit(item: int) -> int:
+            await disk.reserve_async(str(item), 60)
+            admitted.append(item)
+            return item
+
+        async def fail(_item: int) -> None:
+            await sleep(0.05)
+            msg = "stage failed"
+            raise ValueError(msg)
+
+        stages = [Stage("admit", admit, 1), Stage("fail", fail, 1)]
+        with pytest.raises(ExceptionGroup) as excinfo:
+            run(wait_for(run_stages(range(10), stages), timeout=5))
+        assert excinfo.group_contains(ValueError, match="stage failed")
+        assert admitted == [0]
@@ -0,0 +1,48 @@
+from asyncio import run
+from pathlib import Path
+from threading import Event
+
+import pytest
+
+from hdx.scraper.buildings.common import tiles
+from hdx.scraper.buildings.common.config import S3_VARIANTS
+from hdx.scraper.buildings.common.tiles import Tile, _convert
+
+
+async def _convert_tile(tile: Tile, uploaded: Event) -> None:
+    """Convert a tile, recording when the upload of its sorted file starts."""
+
+    async def convert(_tile: Tile) -> None:
+        return
+
+    async def upload_variant(_tile: Tile, subfolder: str) -> None:
+        assert subfolder == S3_VARIANTS[0]
+        uploaded.set()
+
+    tile = await _convert(convert, upload_variant, tile)
+    assert tile.sorted_upload is not None
+    await tile.sorted_upload
+
+
+class TestTiles:
+    """Test converting a tile."""
+
+    def test_sorted_upload_overlaps_variants(
+        self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> None:
+        """Test that the sorted file uploads while the variants are written."""
+        uploaded = Event()
+        overlapped = []
+
+        def write_variants(*_paths: Path) -> None:
+            overlapped.append(uploaded.wait(timeout=5))
+
+        monkeypatch.setattr(tiles, "write_variants", write_variants)
+        tile = Tile(
+            url="https://example.com/tile.csv.gz",
+            output_dir=tmp_path,
+            s3_key="tile.parquet",
+            raw_path=tmp_path / "tile.csv",
+        )
+        run(_convert_tile(tile, uploaded))
+        assert overlapped == [True]